@@ -0,0 +1,152 @@
+"""Time rendering a run's checklist with the templates against the
+f-string __format__ renderer they replaced (kept below as legacy_*).
+
+    python -m benchmarks.render [sections] [items per section] [targets]
+"""
+
+import sys
+import timeit
+from listen.database import Item, Run, Section, Target
+from listen.templates import collapse
+
+
+def legacy_css_classes(check_state):
+    if check_state is None:
+        return "unchecked actionable"
+    elif check_state == "normal":
+        return "checked actionable"
+    else:
+        return "disabled"
+
+
+def legacy_as_checkbox(item, run, checked):
+    if item.type == "once":
+        classes = legacy_css_classes(checked.get(None))
+
+        return f"""
+            <li
+                hx-post="/checkmarks/check/{run.id}/{item.id}"
+                hx-swap="outerHTML"
+                hx-trigger="click[!ctrlKey]"
+                hx-sse="swap:item-{item.id}"
+                class="{classes}"
+            >{item.name}
+                <span
+                    hx-post="/checkmarks/disable/{run.id}/{item.id}"
+                    hx-swap="outerHTML"
+                    hx-target="closest li"
+                    hx-trigger="click[ctrlKey] from:closest li"
+                ></span>
+            </li>
+        """
+    else:
+        if len(checked) == len(run.targets):
+            extra_class = " checked"
+        else:
+            extra_class = ""
+        return f"""
+            <li
+                class="multi{extra_class}"
+                hx-swap="outerHTML"
+                hx-sse="swap:item-{item.id}"
+            >{item.name}
+            <ul>
+            {"\n".join(
+                f'''<li
+                    class="{legacy_css_classes(checked.get(target.id))}"
+                    hx-post="/checkmarks/check/{run.id}/{item.id}/{target.id}"
+                    hx-swap="outerHTML"
+                    hx-target="closest li.multi"
+                    hx-trigger="click[!ctrlKey]"
+                >
+                <span
+                    hx-post="/checkmarks/disable/{run.id}/{item.id}/{target.id}"
+                    hx-swap="outerHTML"
+                    hx-target="closest li.multi"
+                    hx-trigger="click[ctrlKey] from:(closest li)"
+                ></span>
+                <div
+                    class="multilabel target target-{i}"
+                >{target.name}</div></li>'''
+                for i, target in enumerate(run.targets)
+            )}
+            </ul>
+            </li>
+        """
+
+
+def legacy_section_rows(run, section, checked):
+    rows = [f"<section><h2>{section.name}</h2><ul>"]
+    for item in section.items:
+        rows.append(legacy_as_checkbox(item, run, checked.get(item.id, {})))
+    rows.append("</ul></section>")
+    return rows
+
+
+def checklist(n_sections, n_items, n_targets):
+    run = Run(
+        {
+            "id": 1,
+            "runbook_id": 1,
+            "name": "Release",
+            "revision": 0,
+            "slot_count": 0,
+            "checked_count": 0,
+            "skipped_count": 0,
+        }
+    )
+    run.targets = [
+        Target({"id": t, "run_id": 1, "name": f"host-{t}"}) for t in range(n_targets)
+    ]
+    sections = []
+    checked = {}
+    for s in range(n_sections):
+        section = Section(
+            {"id": s, "runbook_id": 1, "name": f"Section {s}", "rank": s}
+        )
+        section.items = []
+        for i in range(n_items):
+            id = s * n_items + i
+            item = Item(
+                {
+                    "id": id,
+                    "section_id": s,
+                    "name": f"Check that service {id} is up & running",
+                    "type": "each" if i % 2 else "once",
+                    "rank": i,
+                }
+            )
+            section.items.append(item)
+            if id % 3 == 0:
+                checked[id] = {None if item.type == "once" else 0: "normal"}
+        sections.append(section)
+    return run, sections, checked
+
+
+def main(n_sections=20, n_items=25, n_targets=4):
+    run, sections, checked = checklist(n_sections, n_items, n_targets)
+
+    def legacy():
+        return "\n".join(
+            row
+            for section in sections
+            for row in legacy_section_rows(run, section, checked)
+        )
+
+    def templates():
+        return "\n".join(
+            row for section in sections for row in run.section_rows(section, checked)
+        )
+
+    # Same markup up to whitespace, and escaping (the legacy renderer
+    # inserted names as they were; the sample names contain "&").
+    assert collapse(legacy()) == collapse(templates()).replace("&amp;", "&")
+    size = f"{len(legacy())} bytes legacy, {len(templates())} bytes templates"
+    print(f"{n_sections} sections x {n_items} items, {n_targets} targets: {size}")
+    for name, render in (("legacy", legacy), ("templates", templates)):
+        number, total = timeit.Timer(render).autorange()
+        print(f"{name:>10}: {total / number * 1000:.2f} ms per checklist")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
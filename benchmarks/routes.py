@@ -0,0 +1,203 @@
+"""Latency, throughput and queries per request of the main routes.
+
+    python -m benchmarks.routes [--requests N] [--concurrency N]
+        [--output FILE] [--keep] [seed options, see benchmarks.seed]
+
+Seeds the database, serves the app in this process on a local port and
+sends it HTTP requests from `concurrency` client threads. The results are
+written as JSON, one object per scenario, so that runs on two commits
+can be compared; --keep leaves the seeded rows in place.
+"""
+
+import argparse
+import asyncio
+import http.client
+import itertools
+import json
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import time
+import urllib.parse
+from pathlib import Path
+import psycopg
+from listen import database
+from listen.app import app
+from . import seed
+
+
+def scenarios(seeded, items, rng):
+    # name -> function returning the (method, path, form) of the next request
+    runbooks, runs = seeded["runbooks"], seeded["runs"]
+    names = itertools.count()
+
+    def toggle():
+        run_id, item_id, target_id = rng.choice(items)
+        if target_id is None:
+            return "POST", f"/checkmarks/check/{run_id}/{item_id}", None
+        return "POST", f"/checkmarks/check/{run_id}/{item_id}/{target_id}", None
+
+    def rename():
+        # Name changes in a handful of items, as when several people type.
+        n = next(names)
+        _, item_id, _ = items[n % 8]
+        return "POST", f"/items/change/{item_id}", {"name": f"Item {n}"}
+
+    return {
+        "runbooks": lambda: ("GET", "/runbooks", None),
+        "runbook": lambda: ("GET", f"/runbooks/{rng.choice(runbooks)}", None),
+        "run": lambda: ("GET", f"/runs/{rng.choice(runs)}", None),
+        "toggle": toggle,
+        "rename": rename,
+    }
+
+
+def checkable(conninfo, runs):
+    # (run_id, item_id, target_id) of every checkbox of the seeded runs
+    with psycopg.connect(conninfo) as conn:
+        return conn.execute(
+            """
+                SELECT runs.id, items.id, targets.id
+                FROM runs
+                JOIN sections ON sections.runbook_id = runs.runbook_id
+                JOIN items ON items.section_id = sections.id
+                LEFT JOIN targets ON targets.run_id = runs.id AND items.type = 'each'
+                WHERE runs.id = ANY(%(runs)s)
+                    AND (items.type = 'once' OR targets.id IS NOT NULL)
+                ORDER BY runs.id, items.id, targets.id
+            """,
+            {"runs": runs},
+        ).fetchall()
+
+
+class Client:
+    """Keep-alive HTTP connection of one client thread."""
+
+    def __init__(self, port):
+        self.conn = http.client.HTTPConnection("127.0.0.1", port)
+
+    def send(self, method, path, form):
+        body = headers = None
+        if form is not None:
+            body = urllib.parse.urlencode(form)
+            headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        start = time.perf_counter()
+        self.conn.request(method, path, body, headers or {})
+        response = self.conn.getresponse()
+        response.read()
+        return time.perf_counter() - start, response.status
+
+
+async def measure(port, next_request, requests, concurrency):
+    latencies = []
+    statuses = {}
+    remaining = itertools.count(requests, -1)
+
+    def worker():
+        client = Client(port)
+        while next(remaining) > 0:
+            latency, status = client.send(*next_request())
+            latencies.append(latency)
+            statuses[status] = statuses.get(status, 0) + 1
+        client.conn.close()
+
+    queries = database.Instrumented.executed
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(asyncio.to_thread(worker) for _ in range(concurrency))
+    )
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "statuses": {str(status): n for status, n in sorted(statuses.items())},
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "throughput_rps": requests / elapsed,
+        "queries_per_request": (database.Instrumented.executed - queries) / requests,
+    }
+
+
+async def serve():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    server = await app.create_server(
+        sock=sock,
+        return_asyncio_server=True,
+        access_log=False,
+    )
+    await server.startup()
+    await server.before_start()
+    await server.start_serving()
+    await server.after_start()
+    return server, sock.getsockname()[1]
+
+
+async def run(args, seeded, items):
+    server, port = await serve()
+    rng = random.Random(0)
+    results = {}
+    try:
+        for name, next_request in scenarios(seeded, items, rng).items():
+            # one untimed pass, so that every scenario starts warm
+            await measure(port, next_request, args.concurrency, args.concurrency)
+            results[name] = await measure(
+                port, next_request, args.requests, args.concurrency
+            )
+    finally:
+        await server.before_stop()
+        server.close()
+        await server.after_stop()
+    return results
+
+
+def commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    seed.add_arguments(parser)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--output", help="file for the JSON results (default stdout)")
+    parser.add_argument("--keep", action="store_true")
+    args = parser.parse_args()
+    app.config.DB_SPEC = args.db
+    sizes = {name: getattr(args, name) for name in seed.DEFAULTS}
+    seeded = seed.seed(args.db, **sizes)
+    try:
+        items = checkable(args.db, seeded["runs"])
+        results = asyncio.run(run(args, seeded, items))
+    finally:
+        if not args.keep:
+            seed.clean(args.db)
+    report = {
+        "commit": commit(),
+        "python": platform.python_version(),
+        "seed": sizes,
+        "scenarios": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Fill the database with synthetic runbooks for the route benchmarks.
+
+    python -m benchmarks.seed [--runbooks N] [--sections N] [--items N]
+        [--runs N] [--targets N] [--checked FRACTION] [--clean]
+
+Counts are per parent: --sections per runbook, --items per section and
+so on. Every runbook is named "bench <n>"; --clean deletes them (and by
+cascade everything else that was seeded) instead.
+"""
+
+import argparse
+import psycopg
+from listen.database import DB_SPEC
+from listen.migrate import migrate
+
+
+PREFIX = "bench"
+
+DEFAULTS = {
+    "runbooks": 50,
+    "sections": 5,
+    "items": 10,
+    "runs": 3,
+    "targets": 4,
+    "checked": 0.5,
+}
+
+
+def seed(conninfo=DB_SPEC, **sizes):
+    sizes = DEFAULTS | sizes
+    migrate(conninfo)
+    with psycopg.connect(conninfo) as conn:
+        # random() drives the checkmarks; the same sizes give the same data
+        conn.execute("SELECT setseed(0.5)")
+        runbooks = ids(
+            conn,
+            """
+                INSERT INTO runbooks (name)
+                SELECT %(prefix)s || ' ' || n FROM generate_series(1, %(runbooks)s) n
+                RETURNING id
+            """,
+            prefix=PREFIX,
+            **sizes,
+        )
+        sections = ids(
+            conn,
+            """
+                INSERT INTO sections (runbook_id, name, rank)
+                SELECT runbook_id, 'Section ' || n, n
+                FROM unnest(%(parents)s::integer[]) runbook_id,
+                    generate_series(1, %(sections)s) n
+                RETURNING id
+            """,
+            parents=runbooks,
+            **sizes,
+        )
+        ids(
+            conn,
+            """
+                INSERT INTO items (section_id, name, type, rank)
+                SELECT
+                    section_id,
+                    'Check that service ' || n || ' is up & running',
+                    CASE WHEN n %% 2 = 0 THEN 'each' ELSE 'once' END::itemtype,
+                    n
+                FROM unnest(%(parents)s::integer[]) section_id,
+                    generate_series(1, %(items)s) n
+                RETURNING id
+            """,
+            parents=sections,
+            **sizes,
+        )
+        runs = ids(
+            conn,
+            """
+                INSERT INTO runs (runbook_id, name)
+                SELECT runbook_id, 'Release ' || n
+                FROM unnest(%(parents)s::integer[]) runbook_id,
+                    generate_series(1, %(runs)s) n
+                RETURNING id
+            """,
+            parents=runbooks,
+            **sizes,
+        )
+        ids(
+            conn,
+            """
+                INSERT INTO targets (run_id, name)
+                SELECT run_id, 'host-' || n
+                FROM unnest(%(parents)s::integer[]) run_id,
+                    generate_series(1, %(targets)s) n
+                RETURNING id
+            """,
+            parents=runs,
+            **sizes,
+        )
+        conn.execute(
+            """
+                INSERT INTO checkmarks (run_id, item_id, target_id, type)
+                SELECT
+                    runs.id,
+                    items.id,
+                    targets.id,
+                    CASE WHEN random() < 0.1 THEN 'not applicable' ELSE 'normal' END::checktype
+                FROM runs
+                JOIN sections ON sections.runbook_id = runs.runbook_id
+                JOIN items ON items.section_id = sections.id
+                LEFT JOIN targets ON targets.run_id = runs.id AND items.type = 'each'
+                WHERE runs.id = ANY(%(runs)s)
+                    AND (items.type = 'once' OR targets.id IS NOT NULL)
+                    AND random() < %(checked)s
+            """,
+            {"runs": runs, "checked": sizes["checked"]},
+        )
+    return {"runbooks": runbooks, "runs": runs}
+
+
+def ids(conn, query, **params):
+    return [id for id, in conn.execute(query, params)]
+
+
+def clean(conninfo=DB_SPEC):
+    with psycopg.connect(conninfo) as conn:
+        conn.execute(
+            "DELETE FROM runbooks WHERE name LIKE %(pattern)s",
+            {"pattern": f"{PREFIX} %"},
+        )
+
+
+def add_arguments(parser):
+    for name, default in DEFAULTS.items():
+        parser.add_argument(f"--{name}", type=type(default), default=default)
+    parser.add_argument("--db", default=DB_SPEC, help="libpq connection string")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument("--clean", action="store_true")
+    args = vars(parser.parse_args())
+    conninfo = args.pop("db")
+    if args.pop("clean"):
+        clean(conninfo)
+    else:
+        seeded = seed(conninfo, **args)
+        print(f"seeded {len(seeded['runbooks'])} runbooks, {len(seeded['runs'])} runs")
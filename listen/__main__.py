@@ -0,0 +1,29 @@
+"""Production entry point: python -m listen
+
+Migrates the database, then serves the app from LISTEN_WORKERS processes
+(0 for one per CPU) under Sanic's worker manager. Every setting is read
+from the environment; see the defaults in app.py (LISTEN_DB_SPEC,
+LISTEN_HOST, LISTEN_PORT, LISTEN_POOL_MAX_SIZE, ...).
+"""
+
+from sanic import Sanic
+from sanic.worker.loader import AppLoader
+from .migrate import migrate
+
+
+if __name__ == "__main__":
+    # Worker processes import the app by name through the loader.
+    loader = AppLoader("listen.app:app")
+    app = loader.load()
+    migrate(app.config.DB_SPEC)
+    if app.config.WORKERS:
+        workers = {"workers": app.config.WORKERS}
+    else:
+        workers = {"fast": True}
+    app.prepare(
+        host=app.config.HOST,
+        port=app.config.PORT,
+        access_log=False,
+        **workers,
+    )
+    Sanic.serve(primary=app, app_loader=loader)
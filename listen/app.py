@@ -1,62 +1,249 @@
+import asyncio
+import functools
+import gzip
 import string
 from pathlib import Path
-from sanic import Sanic, file, html, redirect
-from .database import Runbook, Section, Item, Run, Target
-
-
-app = Sanic("listen")
+from sanic import Sanic, empty, html, json, raw, redirect
+from sanic.config import Config
+from sanic.exceptions import NotFound
+from .assets import IMMUTABLE, Asset, Assets, negotiate
+from .cache import fragments
+from .encoding import compression
+from .database import (
+    Runbook,
+    Section,
+    Item,
+    Run,
+    Ranked,
+    Target,
+    DB_SPEC,
+    open_pool,
+    close_pool,
+    pool_stats,
+    unit_of_work,
+    UnitOfWork,
+)
+from .events import Invalidations, Notifications, RunUpdates
+from .queries import QueryLog, query_log, statements
+
+
+app = Sanic(
+    "listen",
+    # Settings can be overridden from the environment, e.g. LISTEN_POOL_MAX_SIZE=20
+    config=Config(
+        defaults={
+            # libpq connection string
+            "DB_SPEC": DB_SPEC,
+            # where `python -m listen` serves, and with how many worker
+            # processes (0: one per CPU)
+            "HOST": "127.0.0.1",
+            "PORT": 8000,
+            "WORKERS": 1,
+            "POOL_MIN_SIZE": 2,
+            "POOL_MAX_SIZE": 10,
+            # upper bound for the memory held by rendered runbook fragments
+            "FRAGMENT_CACHE_SIZE": 64 * 1024 * 1024,
+            # seconds between keepalive comments on idle event streams
+            "EVENTS_KEEPALIVE": 15,
+            # rows per page of the runbook and run listings
+            "PAGE_SIZE": 50,
+            # runs shown under each runbook of the listing
+            "RECENT_RUNS": 5,
+            # serve /debug/pool, /debug/cache and /debug/queries (and collect
+            # the totals per route and statement behind the latter)
+            "DEBUG_STATS": False,
+            # times a statement may run in one request before it is reported
+            # as an N+1 candidate
+            "N_PLUS_ONE_REPEATS": 5,
+            # responses smaller than this many bytes are sent uncompressed
+            "COMPRESS_MIN_SIZE": 1024,
+            "GZIP_LEVEL": 6,
+            "BROTLI_QUALITY": 4,
+            "ZSTD_LEVEL": 3,
+        },
+        env_prefix="LISTEN_",
+    ),
+)
 root = Path(__file__).parent
 with (root / "index.html").open() as f:
     INDEX = string.Template(f.read())
+assets = Assets(root, ["htmx.min.js", "Satisfy-Regular.woff2", "favicon.ico"])
+run_updates = RunUpdates(Run.live_messages)
+invalidations = Invalidations(fragments)
+notifications = Notifications(run_updates, invalidations)
+
+
+@app.before_server_start
+async def warm_up_pool(app):
+    await open_pool(
+        app.config.DB_SPEC,
+        app.config.POOL_MIN_SIZE,
+        app.config.POOL_MAX_SIZE,
+    )
+    fragments.max_bytes = app.config.FRAGMENT_CACHE_SIZE
+    statements.enabled = app.config.DEBUG_STATS
+    QueryLog.repeats = app.config.N_PLUS_ONE_REPEATS
+    compression.min_size = app.config.COMPRESS_MIN_SIZE
+    compression.gzip_level = app.config.GZIP_LEVEL
+    compression.brotli_quality = app.config.BROTLI_QUALITY
+    compression.zstd_level = app.config.ZSTD_LEVEL
+    notifications.start(app.config.DB_SPEC)
+
+
+@app.before_server_stop
+async def finish_renumbering(app):
+    await Ranked.drain()
+
+
+@app.after_server_stop
+async def drain_pool(app):
+    await notifications.stop()
+    await close_pool()
+
+
+@app.on_request
+async def begin_unit_of_work(request):
+    unit_of_work.set(UnitOfWork())
+    route = request.route.path if request.route else request.path
+    query_log.set(QueryLog(route, statements if statements.enabled else None))
 
 
 @app.on_response
 async def default_response(request, response):
     if isinstance(response, str):
-        return html(response)
+        response = html(response)
+    # Streamed responses get here before their body: it is read outside
+    # the unit of work.
+    if (uow := unit_of_work.get()) is not None:
+        unit_of_work.set(None)
+        await uow.close(commit=response.status < 400)
+    # Statements run while a response streams are not in its header, but
+    # still count for /debug/queries.
+    if (log := query_log.get()) is not None:
+        response.headers["Server-Timing"] = log.server_timing()
+    compression.compress(request, response)
     return response
 
 
+def validators(etag):
+    # no-cache: clients may keep the body but must revalidate it every time
+    return {"ETag": etag, "Cache-Control": "no-cache"}
+
+
+def etag_matches(request, etag):
+    if_none_match = request.headers.get("if-none-match", "")
+    return etag in (tag.strip() for tag in if_none_match.split(","))
+
+
+def not_modified(request, etag):
+    if etag is None:
+        raise NotFound()
+    if etag_matches(request, etag):
+        return empty(status=304, headers=validators(etag))
+
+
+def serve_asset(request, asset, cache_control="no-cache"):
+    headers = {
+        "ETag": asset.etag,
+        "Cache-Control": cache_control,
+        "Vary": "Accept-Encoding",
+    }
+    if etag_matches(request, asset.etag):
+        return empty(status=304, headers=headers)
+    body, encoding = asset.encoded(request.headers.get("accept-encoding", ""))
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return raw(body, content_type=asset.content_type, headers=headers)
+
+
+@functools.lru_cache(maxsize=256)
+def index_shell(autoload):
+    # Every page is this shell loading its content; it only differs in
+    # what it loads, and the assets it links to are fingerprinted.
+    page = INDEX.substitute(
+        autoload=autoload,
+        favicon=assets.url("/vendor", "favicon.ico"),
+        htmx_js=assets.url("/vendor", "htmx.min.js"),
+        satisfy_font=assets.url("/vendor", "Satisfy-Regular.woff2"),
+    )
+    return Asset(page.encode("utf-8"), "text/html; charset=utf-8")
+
+
 @app.get("/")
 async def index(request):
-    return INDEX.substitute(autoload="/runbooks")
+    return serve_asset(request, index_shell("/runbooks"))
 
 
 @app.get("/_/runbooks/<runbook_id>")
 async def direct_runbook(request, runbook_id: int):
-    return INDEX.substitute(autoload=f"/runbooks/{runbook_id}")
+    return serve_asset(request, index_shell(f"/runbooks/{runbook_id}"))
 
 
 @app.get("/_/runs/<run_id>")
 async def direct_run(request, run_id: int):
-    return INDEX.substitute(autoload=f"/runs/{run_id}")
+    return serve_asset(request, index_shell(f"/runs/{run_id}"))
+
+
+def next_page(url, entities):
+    # Placeholder replaced by the following page once scrolled into view;
+    # a short page is the last one.
+    if len(entities) < app.config.PAGE_SIZE:
+        return ""
+    return f"""<div
+        hx-get="{url}?after={entities[-1].id}"
+        hx-trigger="revealed"
+        hx-swap="outerHTML"
+    ></div>"""
 
 
 @app.get("/runbooks")
 async def list_runbooks(request):
-    return f"""
+    etag = await Runbook.list_etag()
+    if response := not_modified(request, etag):
+        return response
+    after = int(request.args.get("after", 0))
+    runbooks = await Runbook.page(app.config.PAGE_SIZE, after)
+    await Runbook.fetch_recent_runs(runbooks, app.config.RECENT_RUNS)
+    body = f"""
+        {"\n\n".join(f"{lst:link}" for lst in runbooks)}
+        {next_page("/runbooks", runbooks)}
+    """
+    if not after:
+        body = f"""
         {Runbook.load_input()}
-        {"\n\n".join(f"{lst:link}" for lst in Runbook.all())}
+        {body}
         {Runbook.new_runbook_input()}
     """
+    return html(body, headers=validators(etag))
 
 
 @app.get("/runs")
 async def list_runs(request):
-    return "\n\n".join(f"{lst:link}" for lst in Run.all())
+    runs = await Run.page(app.config.PAGE_SIZE, int(request.args.get("after", 0)))
+    return f"""
+        {"\n\n".join(f"{lst:link}" for lst in runs)}
+        {next_page("/runs", runs)}
+    """
 
 
 @app.get("/runbooks/<runbook_id>")
 async def view_runbook(request, runbook_id: int):
-    runbook = Runbook.from_id(runbook_id)
-    return f"{runbook:detail}"
+    etag = await Runbook.etag(runbook_id)
+    if response := not_modified(request, etag):
+        return response
+    # Unchanged runbooks are served without loading or rendering anything.
+    if (body := fragments.get(("runbooks", runbook_id, "detail", etag))) is None:
+        runbook = await Runbook.from_id(runbook_id)
+        await asyncio.gather(runbook.load_tree(), runbook.fetch_runs())
+        body = runbook.render_cached("detail", version=etag)
+    return html(body, headers=validators(etag))
 
 
 @app.post("/items/new/<section_id>")
 async def new_item(request, section_id: int):
     name = request.form.get("name")
     section_id = int(section_id)
-    item = Item.create(name=name, section_id=section_id)
+    item = await Item.create(name=name, section_id=section_id)
     return f"""
         {item:detail}
         {Section.new_item_input(section_id, focus=True)}
@@ -65,74 +252,123 @@ async def new_item(request, section_id: int):
 
 @app.post("/items/toggle/<item_id>")
 async def toggle_item(request, item_id: int):
-    item = Item.from_id(item_id)
-    item.toggle()
+    if (item := await Item.from_id(item_id)) is None:
+        raise NotFound()
+    await item.toggle()
     return f"{item:detail}"
 
 
+def optional_id(request, name):
+    value = request.form.get(name)
+    return int(value) if value else None
+
+
+# The move routes are sent by the drag-and-drop script of index.html once
+# it has moved the element: `before` is the sibling it now precedes
+# (missing at the end), `section_id` the section an item was dropped in
+# (missing when that didn't change).
+
+
+@app.post("/sections/move/<section_id>")
+async def move_section(request, section_id: int):
+    if await Section.move(section_id, before=optional_id(request, "before")) is None:
+        raise NotFound()
+    return empty()
+
+
+@app.post("/items/move/<item_id>")
+async def move_item(request, item_id: int):
+    item = await Item.move(
+        item_id,
+        before=optional_id(request, "before"),
+        parent_id=optional_id(request, "section_id"),
+    )
+    if item is None:
+        raise NotFound()
+    return empty()
+
+
+# The change routes are fired by the contenteditables once typing pauses
+# (with hx-swap="none"): the keystrokes of a name are coalesced in the
+# browser, where all of them are seen, rather than here, where they may
+# reach different workers. Each element sends its changes one at a time
+# and in order (hx-sync), so names are written directly and nothing is
+# rendered.
+
+
+async def rename(cls, id, name):
+    if await cls.update(id, name=name) is None:
+        raise NotFound()
+    return empty()
+
+
 @app.post("/items/change/<item_id>")
 async def change_item(request, item_id: int):
-    item = Item.from_id(item_id)
-    name = request.form.get("name")
-    if not name:
-        item.delete()
-        return ""
-    else:
-        item.rename(name)
-        return f"{item:detail}"
+    if name := request.form.get("name"):
+        return await rename(Item, item_id, name)
+    # already gone when the deleting change is repeated
+    if (item := await Item.from_id(item_id)) is not None:
+        await item.delete()
+    return empty()
 
 
 @app.post("/sections/change/<section_id>")
 async def change_section(request, section_id: int):
-    section = Section.from_id(section_id)
-    name = request.form.get("name")
-    if not name:
-        section.delete()
-        return ""
-    else:
-        section.rename(name)
-        return f"{section:detail}"
+    if name := request.form.get("name"):
+        return await rename(Section, section_id, name)
+    if (section := await Section.from_id(section_id)) is not None:
+        await section.delete()
+    return empty()
 
 
 @app.post("/runbooks/change/<runbook_id>")
 async def change_runbook(request, runbook_id: int):
-    runbook = Runbook.from_id(runbook_id)
-    name = request.form.get("name")
-    if name:
-        runbook.rename(name)
-    return f"{runbook:heading}"
+    if name := request.form.get("name"):
+        return await rename(Runbook, runbook_id, name)
+    return empty()
 
 
 @app.post("/runbooks/load")
 async def load_runbook(request):
-    code = request.form.get("code")
-    runbook = Runbook.load(code)
-    return redirect(f"/runbooks/{runbook.id}")
+    # Several share codes can be pasted at once, separated by whitespace
+    # (which never occurs inside a code).
+    codes = request.form.get("code").split()
+    runbooks = await Runbook.load_many(codes)
+    if len(runbooks) == 1:
+        return redirect(f"/runbooks/{runbooks[0].id}")
+    return redirect("/runbooks")
 
 
 @app.get("/runbooks/dump/<runbook_id>")
 async def dump_runbook(request, runbook_id: int):
-    runbook = Runbook.from_id(runbook_id)
+    etag = await Runbook.etag(runbook_id)
+    if etag is None:
+        raise NotFound()
+    # The code is encoded once per revision of the runbook.
+    if (code := fragments.get(("runbooks", runbook_id, "dump_data", etag))) is None:
+        runbook = await Runbook.from_id(runbook_id)
+        await runbook.load_tree()
+        code = runbook.render_cached("dump_data", version=etag)
     return f"""<script>
-    window.prompt('Press Ctrl+C, Enter', '{runbook:dump_data}');
+    window.prompt('Press Ctrl+C, Enter', '{code}');
     </script>
-    {runbook:dump_button}
+    {Runbook.dump_button(runbook_id)}
     """
 
 
 @app.post("/runs/change/<run_id>")
 async def change_run(request, run_id: int):
-    run = Run.from_id(run_id)
-    name = request.form.get("name")
-    if name:
-        run.rename(name)
-    return f"{run:heading}"
+    if name := request.form.get("name"):
+        return await rename(Run, run_id, name)
+    return empty()
 
 
 @app.post("/sections/new/<runbook_id>")
 async def new_section(request, runbook_id: int):
     name = request.form.get("name")
-    section = Section.create(name=name, runbook_id=runbook_id)
+    section = await Section.create(name=name, runbook_id=runbook_id)
+    section.items = []
+    section.generation = None
     return f"""
         {section:detail}
         {Runbook.new_section_input(runbook_id)}
@@ -142,7 +378,7 @@ async def new_section(request, runbook_id: int):
 @app.post("/runs/new/<runbook_id>")
 async def new_run(request, runbook_id: int):
     name = request.form.get("name")
-    run = Run.create(runbook_id=runbook_id, name=name)
+    run = await Run.create(runbook_id=runbook_id, name=name)
     return f"""
         <li>{run:link}</li>
         {Runbook.new_section_input(runbook_id)}
@@ -152,24 +388,93 @@ async def new_run(request, runbook_id: int):
 @app.post("/runbooks/new")
 async def new_runbook(request):
     name = request.form.get("name")
-    runbook = Runbook.create(name=name)
+    runbook = await Runbook.create(name=name)
+    runbook.runs = []
+    runbook.run_count = 0
     return f"""
         {runbook:link}
         {Runbook.new_runbook_input()}
     """
 
 
+async def respond_stream(request, **kwargs):
+    # Streamed bodies skip the response hook: they are compressed chunk by
+    # chunk as they are sent.
+    response = await request.respond(**kwargs)
+    return compression.stream(request, response)
+
+
 @app.get("/runs/<run_id>")
 async def view_run(request, run_id: int):
-    run = Run.from_id(run_id)
-    return f"{run:detail}"
+    etag, completed = await Run.version(run_id)
+    if response := not_modified(request, etag):
+        return response
+    if completed:
+        return await view_snapshot(request, run_id, headers=validators(etag))
+    response = await respond_stream(
+        request,
+        content_type="text/html; charset=utf-8",
+        headers=validators(etag),
+    )
+    async for chunk in Run.stream_detail(run_id):
+        await response.send(chunk)
+    await response.eof()
+
+
+async def view_snapshot(request, run_id, headers):
+    # Completed runs are sent as stored: gzip-compressed, unless the client
+    # doesn't take gzip (then the response hook may compress it otherwise).
+    body = await Run.snapshot(run_id)
+    if negotiate(request.headers.get("accept-encoding", ""), ["gzip"]):
+        headers = {**headers, "Content-Encoding": "gzip", "Vary": "Accept-Encoding"}
+        return raw(body, content_type="text/html; charset=utf-8", headers=headers)
+    return html(gzip.decompress(body), headers=headers)
+
+
+@app.post("/runs/complete/<run_id>")
+async def complete_run(request, run_id: int):
+    if (body := await Run.complete(run_id)) is None:
+        raise NotFound()
+    return body
+
+
+def sse(event, data):
+    lines = "".join(f"data: {line}\n" for line in data.splitlines())
+    return f"event: {event}\n{lines}\n"
+
+
+@app.get("/runs/<run_id>/events")
+async def run_events(request, run_id: int):
+    # Every change to the run, from any client, is pushed here as soon as it
+    # is committed; see RunUpdates.
+    response = await respond_stream(
+        request,
+        content_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+    with run_updates.subscribe(run_id) as queue:
+        while True:
+            try:
+                messages = await asyncio.wait_for(
+                    queue.get(),
+                    app.config.EVENTS_KEEPALIVE,
+                )
+            except asyncio.TimeoutError:
+                await response.send(": keepalive\n\n")
+                continue
+            await response.send("".join(sse(*message) for message in messages))
+
+
+def checkbox(body):
+    # Item.check() writes nothing to completed runs.
+    if body is None:
+        raise NotFound()
+    return body
 
 
 @app.post("/checkmarks/disable/<run_id>/<item_id>")
 async def disable_checkmark(request, run_id: int, item_id: int):
-    item = Item.from_id(item_id)
-    run = Run.from_id(run_id)
-    return item.check_for(run, disable=True)
+    return checkbox(await Item.check(run_id, item_id, disable=True))
 
 
 @app.post("/checkmarks/disable/<run_id>/<item_id>/<target_id>")
@@ -179,16 +484,14 @@ async def disable_checkmark_for_target(
     item_id: int,
     target_id: int,
 ):
-    item = Item.from_id(item_id)
-    run = Run.from_id(run_id)
-    return item.check_for(run, target_id=target_id, disable=True)
+    return checkbox(
+        await Item.check(run_id, item_id, target_id=target_id, disable=True)
+    )
 
 
 @app.post("/checkmarks/check/<run_id>/<item_id>")
 async def check_checkmark(request, run_id: int, item_id: int):
-    item = Item.from_id(item_id)
-    run = Run.from_id(run_id)
-    return item.check_for(run)
+    return checkbox(await Item.check(run_id, item_id))
 
 
 @app.post("/checkmarks/check/<run_id>/<item_id>/<target_id>")
@@ -198,29 +501,52 @@ async def check_checkmark_for_target(
     item_id: int,
     target_id: int,
 ):
-    item = Item.from_id(item_id)
-    run = Run.from_id(run_id)
-    return item.check_for(run, target_id=target_id)
+    return checkbox(await Item.check(run_id, item_id, target_id=target_id))
 
 
 @app.post("/targets/new/<run_id>")
 async def new_target(request, run_id: int):
-    run = Run.from_id(run_id)
     name = request.form.get("name")
-    Target.create(run_id=run.id, name=name)
-    return f"{run:detail}"
+    if (run := await Run.from_id(run_id)) is None or run.completed_at is not None:
+        raise NotFound()
+    # Every viewer of the run, this one included, gets the new labels and
+    # checkboxes from its event stream.
+    await Target.create(run_id=run_id, name=name)
+    return empty()
 
 
-@app.get("/vendor/htmx.min.js")
-async def _htmx_js(request):
-    return await file(root / "htmx.min.js")
-
-
-@app.get("/vendor/Satisfy-Regular.woff2")
-async def _satisfy_font(request):
-    return await file(root / "Satisfy-Regular.woff2")
+@app.get("/vendor/<name>")
+async def vendor(request, name: str):
+    if (asset := assets.get(name)) is None:
+        raise NotFound()
+    if assets.immutable(name):
+        return serve_asset(request, asset, IMMUTABLE)
+    return serve_asset(request, asset)
 
 
 @app.get("/favicon.ico")
 async def _favicon(request):
-    return await file(root / "favicon.ico")
+    return await vendor(request, "favicon.ico")
+
+
+def debug_stats(request):
+    if not request.app.config.DEBUG_STATS:
+        raise NotFound()
+
+
+@app.get("/debug/pool")
+async def _pool_stats(request):
+    debug_stats(request)
+    return json(pool_stats())
+
+
+@app.get("/debug/cache")
+async def _cache_stats(request):
+    debug_stats(request)
+    return json(fragments.stats())
+
+
+@app.get("/debug/queries")
+async def _query_stats(request):
+    debug_stats(request)
+    return json(statements.stats())
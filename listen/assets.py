@@ -0,0 +1,100 @@
+import gzip
+import hashlib
+import logging
+import mimetypes
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+logger = logging.getLogger(__name__)
+
+# Far-future caching for URLs that change whenever their content does.
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+class Asset:
+    """A response body kept in memory together with its compressed forms.
+
+    Encodings that don't make the body smaller are left out.
+    """
+
+    def __init__(self, body, content_type):
+        self.body = body
+        self.content_type = content_type
+        self.digest = hashlib.sha256(body).hexdigest()[:12]
+        # weak, like the other ETags: the body may be sent in any encoding
+        self.etag = f'W/"{self.digest}"'
+        self.encodings = {}
+        # in order of preference
+        candidates = {}
+        if brotli is not None:
+            candidates["br"] = lambda: brotli.compress(body, quality=11)
+        candidates["gzip"] = lambda: gzip.compress(body, 9, mtime=0)
+        for encoding, compress in candidates.items():
+            if len(compressed := compress()) < len(body):
+                self.encodings[encoding] = compressed
+
+    def encoded(self, accept_encoding):
+        # (body, content encoding or None) for an Accept-Encoding header
+        for encoding in negotiate(accept_encoding, self.encodings):
+            return self.encodings[encoding], encoding
+        return self.body, None
+
+
+class Assets:
+    """The static files, read and compressed once.
+
+    Each is served under its own name and under a fingerprinted one
+    ("htmx.min.js" and "htmx.min.<digest>.js"); only the latter is cached
+    for good by clients, see url().
+    """
+
+    def __init__(self, root, names):
+        self.files = {}  # name, plain or fingerprinted -> Asset
+        self.urls = {}  # name -> fingerprinted name
+        for name in names:
+            path = root / name
+            if not path.exists():
+                logger.warning("Static file %s is missing", path)
+                continue
+            content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+            asset = Asset(path.read_bytes(), content_type)
+            stem, dot, suffix = name.rpartition(".")
+            fingerprinted = f"{stem}.{asset.digest}{dot}{suffix}"
+            self.files[name] = self.files[fingerprinted] = asset
+            self.urls[name] = fingerprinted
+
+    def get(self, name):
+        return self.files.get(name)
+
+    def url(self, prefix, name):
+        # Missing files keep their plain URL, which answers 404.
+        return f"{prefix}/{self.urls.get(name, name)}"
+
+    def immutable(self, name):
+        return name not in self.urls
+
+
+def negotiate(accept_encoding, available):
+    # The encodings of `available` the client accepts, preferred first (by
+    # q-value, then by the order of `available`).
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                continue
+        accepted[coding.strip().lower()] = q
+    wildcard = accepted.get("*", 0)
+    ranked = [
+        (-accepted.get(encoding, wildcard), i, encoding)
+        for i, encoding in enumerate(available)
+        if accepted.get(encoding, wildcard) > 0
+    ]
+    return [encoding for _, _, encoding in sorted(ranked)]
@@ -0,0 +1,81 @@
+import sys
+from collections import OrderedDict
+
+
+class FragmentCache:
+    """LRU cache of rendered HTML fragments, bounded by their total size.
+
+    Every entry is tagged with the rows it was rendered from, as
+    (table_name, id) pairs; invalidating a tag drops all entries built from
+    that row. Renders can be put with the `generation` the cache was at
+    when their rows were read: if anything was invalidated since, the rows
+    may be stale and the render isn't kept.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()  # key -> (html, tags)
+        self.tagged = {}  # tag -> keys of the entries carrying it
+        self.generation = 0  # bumped by every invalidation
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        try:
+            html, _ = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return html
+
+    def put(self, key, html, tags, generation=None):
+        if generation is not None and generation != self.generation:
+            return
+        self.discard(key)
+        size = sys.getsizeof(html)
+        if size > self.max_bytes:
+            return
+        self.entries[key] = html, tags
+        self.size += size
+        for tag in tags:
+            self.tagged.setdefault(tag, set()).add(key)
+        while self.size > self.max_bytes:
+            self.discard(next(iter(self.entries)))
+
+    def discard(self, key):
+        if (entry := self.entries.pop(key, None)) is None:
+            return
+        html, tags = entry
+        self.size -= sys.getsizeof(html)
+        for tag in tags:
+            if (keys := self.tagged.get(tag)) is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tagged[tag]
+
+    def invalidate(self, *tags):
+        self.generation += 1
+        for tag in tags:
+            for key in self.tagged.pop(tag, ()):
+                self.discard(key)
+
+    def clear(self):
+        self.generation += 1
+        self.entries.clear()
+        self.tagged.clear()
+        self.size = 0
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+fragments = FragmentCache(max_bytes=64 * 1024 * 1024)
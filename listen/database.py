@@ -1,272 +1,821 @@
-import base64
+import asyncio
+import contextlib
+import contextvars
 import gzip
-import json
-import psycopg
+import logging
+import os
+import time
+from psycopg import AsyncCursor, AsyncServerCursor
+from psycopg.errors import SerializationFailure
 from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+from psycopg_pool import AsyncConnectionPool
+from . import sharecode, templates
+from .cache import fragments
+from .queries import query_log
 
 
-DB_SPEC = "dbname=listen user=jo"
+DB_SPEC = os.environ.get("LISTEN_DB_SPEC", "dbname=listen user=jo")
+pool = None
+logger = logging.getLogger(__name__)
+unit_of_work = contextvars.ContextVar("unit_of_work", default=None)
+
+
+class Instrumented:
+    # Number of statements sent by this process, see benchmarks/routes.py.
+    executed = 0
+
+    async def execute(self, query, *args, **kwargs):
+        Instrumented.executed += 1
+        if (log := query_log.get()) is None:
+            return await super().execute(query, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return await super().execute(query, *args, **kwargs)
+        finally:
+            log.record(query, time.perf_counter() - start, self.rowcount)
+
+
+class Cursor(Instrumented, AsyncCursor):
+    pass
+
+
+class ServerCursor(Instrumented, AsyncServerCursor):
+    pass
+
+
+async def configure(conn):
+    conn.server_cursor_factory = ServerCursor
+
+
+async def open_pool(conninfo=DB_SPEC, min_size=1, max_size=None):
+    global pool
+    pool = AsyncConnectionPool(
+        conninfo,
+        min_size=min_size,
+        max_size=max_size,
+        kwargs={"row_factory": dict_row, "cursor_factory": Cursor},
+        configure=configure,
+        open=False,
+    )
+    # wait=True blocks until min_size connections are established, so the
+    # first requests don't pay for the handshakes.
+    await pool.open(wait=True)
+
+
+async def close_pool():
+    if pool is not None:
+        await pool.close()
+
+
+@contextlib.asynccontextmanager
+async def connection(write=False):
+    # Once the current unit of work has written something, its reads go
+    # through the same transaction so they see those writes.
+    uow = unit_of_work.get()
+    if uow is None or not (write or uow.conn or uow.pending):
+        async with pool.connection() as conn:
+            yield conn
+    else:
+        yield await uow.connection()
+
+
+class UnitOfWork:
+    """Identity map and pending writes of one request.
+
+    Each (table, id) is loaded at most once and keeps its identity.
+    Updates and deletes are queued and flushed, in order, by the next
+    query or by close(); everything the request writes is committed in a
+    single transaction.
+    """
+
+    def __init__(self):
+        self.identity = {}
+        self.pending = []
+        self.committed = []
+        self.conn = None
+        self.lock = asyncio.Lock()
+        self.stack = contextlib.AsyncExitStack()
+
+    def defer(self, write):
+        self.pending.append(write)
+
+    def after_commit(self, callback):
+        self.committed.append(callback)
+
+    async def connection(self):
+        async with self.lock:
+            if self.conn is None:
+                self.conn = await self.stack.enter_async_context(pool.connection())
+            while self.pending:
+                await self.pending.pop(0)(self.conn)
+        return self.conn
+
+    async def close(self, commit=True):
+        # Leaving the pool connection commits, or rolls back on error.
+        async with self.stack:
+            if not commit:
+                self.pending.clear()
+                if self.conn is not None:
+                    await self.conn.rollback()
+            elif self.pending:
+                await self.connection()
+        self.conn = None
+        callbacks, self.committed = self.committed, []
+        if commit:
+            for callback in callbacks:
+                callback()
+
+
+def pool_stats():
+    return pool.get_stats()
+
+
+def tree_query(runbook_id):
+    # JSON array of a runbook's sections in order, each with its ordered
+    # "items" array; runbook_id is an SQL expression so this can be used as
+    # a correlated subquery.
+    return f"""
+        SELECT coalesce(jsonb_agg(
+            to_jsonb(sections) || jsonb_build_object(
+                'items',
+                (
+                    SELECT coalesce(
+                        jsonb_agg(items ORDER BY items.rank, items.id),
+                        '[]'
+                    )
+                    FROM items
+                    WHERE items.section_id=sections.id
+                )
+            )
+            ORDER BY sections.rank, sections.id
+        ), '[]')
+        FROM sections
+        WHERE sections.runbook_id={runbook_id}
+    """
+
+
+def checkbox_query(checkmarks):
+    # Everything Item.as_checkbox needs for the item in the "item" CTE, as
+    # rendered for run %(run_id)s; checkmarks is a query for the item's
+    # (target_id, type) rows.
+    return f"""
+        SELECT
+            to_jsonb(item) AS item,
+            (
+                SELECT to_jsonb(runs) FROM runs WHERE id=%(run_id)s
+            ) AS run,
+            (
+                SELECT coalesce(jsonb_agg(targets ORDER BY targets.id), '[]')
+                FROM targets
+                WHERE run_id=%(run_id)s
+            ) AS targets,
+            (
+                SELECT coalesce(jsonb_agg(jsonb_build_object(
+                    'target_id', target_id,
+                    'type', type
+                )), '[]')
+                FROM ({checkmarks}) AS state
+            ) AS checkmarks
+        FROM item
+    """
+
+
+def build_tree(section_rows, generation=None):
+    # Leaves the rows alone: Run.complete stores them after building.
+    # `generation` is the fragment cache's when the rows were read.
+    sections = []
+    for section_row in section_rows:
+        section = Section({k: v for k, v in section_row.items() if k != "items"})
+        section.items = [Item(item) for item in section_row["items"]]
+        section.generation = generation
+        sections.append(section)
+    return sections
 
 
 class Entity:
+    # Subclasses keep their row in slots: `columns` (the table's, in schema
+    # order) followed by whatever is attached to them after loading.
+    __slots__ = ()
+    columns = ()
+    # foreign key column pointing at the row this one is displayed in
+    parent = None
+    # statement bumping the revision of the runbooks/runs whose rendering
+    # depends on this row (and notifying their live viewers); run with the
+    # written row in the same transaction
+    touch = None
+
     def __init__(self, row):
-        self.__dict__.update(row)
+        self.assign(row)
 
     def __init_subclass__(cls):
         cls.table_name = cls.__name__.lower() + "s"
 
     @classmethod
-    def from_id(cls, id):
-        with psycopg.connect(DB_SPEC, row_factory=dict_row) as conn:
-            return cls(
-                conn.execute(
-                    f"SELECT * FROM {cls.table_name} WHERE id=%(id)s",
-                    {"id": id},
-                ).fetchone()
+    def row_factory(cls, cursor):
+        # psycopg row factory building entities straight from the values of
+        # a query on the table, without an intermediate dict.
+        setters = [getattr(cls, column.name).__set__ for column in cursor.description]
+
+        def make_row(values):
+            entity = cls.__new__(cls)
+            for setter, value in zip(setters, values):
+                setter(entity, value)
+            return entity
+
+        return make_row
+
+    def assign(self, row):
+        for name, value in row.items():
+            setattr(self, name, value)
+
+    def row(self):
+        return {name: getattr(self, name) for name in self.columns}
+
+    def invalidate(self):
+        # Writes to a row make stale the fragments rendered from it, and
+        # adding or removing a child changes its parent's fragments too.
+        tags = [(self.table_name, self.id)]
+        if self.parent is not None:
+            tags.append(
+                (self.parent.removesuffix("_id") + "s", getattr(self, self.parent))
             )
+        fragments.invalidate(*tags)
+
+    def tags(self):
+        return [(self.table_name, self.id)]
+
+    def render_cached(self, fmt, version=None, generation=None):
+        # Without a version, only invalidation keeps the fragment fresh:
+        # pass the generation its rows were read at (see FragmentCache).
+        key = self.table_name, self.id, fmt, version
+        if (html := fragments.get(key)) is None:
+            html = format(self, fmt)
+            fragments.put(key, html, self.tags(), generation)
+        return html
 
     @classmethod
-    def all(cls):
-        with psycopg.connect(DB_SPEC, row_factory=dict_row) as conn:
-            return [cls(row) for row in conn.execute(f"SELECT * FROM {cls.table_name}")]
+    def mapped(cls, entity):
+        if entity is None or (uow := unit_of_work.get()) is None:
+            return entity
+        return uow.identity.setdefault((cls.table_name, entity.id), entity)
 
     @classmethod
-    def create(cls, **kwargs):
-        with psycopg.connect(DB_SPEC, row_factory=dict_row) as conn:
-            return cls(
-                conn.execute(
-                    f"""
-                        INSERT INTO {cls.table_name} ({', '.join(kwargs)})
-                        VALUES ({', '.join(f"%({name})s" for name in kwargs)})
-                        RETURNING *
-                    """,
-                    kwargs,
-                ).fetchone()
+    async def from_id(cls, id):
+        if (uow := unit_of_work.get()) is not None:
+            if entity := uow.identity.get((cls.table_name, id)):
+                return entity
+        async with connection() as conn:
+            cur = await conn.cursor(row_factory=cls.row_factory).execute(
+                f"SELECT * FROM {cls.table_name} WHERE id=%(id)s",
+                {"id": id},
+            )
+            return cls.mapped(await cur.fetchone())
+
+    @classmethod
+    async def all(cls):
+        async with connection() as conn:
+            cur = await conn.cursor(row_factory=cls.row_factory).execute(
+                f"SELECT * FROM {cls.table_name}"
             )
+            return [cls.mapped(entity) async for entity in cur]
 
-    def delete(self):
-        with psycopg.connect(DB_SPEC, row_factory=dict_row) as conn:
-            conn.execute(
+    @classmethod
+    async def create(cls, **kwargs):
+        async with connection(write=True) as conn:
+            cur = await conn.cursor(row_factory=cls.row_factory).execute(
                 f"""
-                    DELETE FROM {self.table_name}
-                    WHERE id=%(id)s
+                    INSERT INTO {cls.table_name} ({', '.join(kwargs)})
+                    VALUES ({', '.join(f"%({name})s" for name in kwargs)})
+                    RETURNING *
                 """,
-                {
-                    "id": self.id,
-                },
+                kwargs,
             )
+            entity = await cur.fetchone()
+            if cls.touch:
+                await conn.execute(cls.touch, entity.row())
+        entity.invalidate()
+        return cls.mapped(entity)
 
-    def mutate(self, **kwargs):
-        with psycopg.connect(DB_SPEC, row_factory=dict_row) as conn:
-            self.__dict__.update(
-                conn.execute(
-                    f"""
-                        UPDATE {self.table_name}
-                        SET {", ".join(f"{name}=%({name})s" for name in kwargs)}
-                        WHERE id=%(id)s
-                        RETURNING *
-                    """,
-                    {
-                        "id": self.id,
-                        **kwargs,
-                    },
-                ).fetchone()
+    async def delete(self):
+        if (uow := unit_of_work.get()) is not None:
+            uow.identity.pop((self.table_name, self.id), None)
+            uow.defer(self._delete)
+        else:
+            async with connection(write=True) as conn:
+                await self._delete(conn)
+        self.invalidate()
+
+    async def _delete(self, conn):
+        await conn.execute(
+            f"""
+                DELETE FROM {self.table_name}
+                WHERE id=%(id)s
+            """,
+            {
+                "id": self.id,
+            },
+        )
+        if self.touch:
+            await conn.execute(self.touch, self.row())
+
+    @classmethod
+    async def update(cls, id, **kwargs):
+        # None if there is no such row
+        async with connection(write=True) as conn:
+            entity = await cls._update(conn, id, kwargs)
+        if entity is not None:
+            entity.invalidate()
+        return entity
+
+    @classmethod
+    async def _update(cls, conn, id, kwargs):
+        cur = await conn.cursor(row_factory=cls.row_factory).execute(
+            f"""
+                UPDATE {cls.table_name}
+                SET {", ".join(f"{name}=%({name})s" for name in kwargs)}
+                WHERE id=%(id)s
+                RETURNING *
+            """,
+            {
+                "id": id,
+                **kwargs,
+            },
+        )
+        entity = await cur.fetchone()
+        if entity is not None and cls.touch:
+            await conn.execute(cls.touch, entity.row())
+        return entity
+
+    async def mutate(self, **kwargs):
+        if (uow := unit_of_work.get()) is None:
+            self.assign((await self.update(self.id, **kwargs)).row())
+            return
+        # Written with the rest of the request; until then the change only
+        # lives in this (identity mapped) object.
+        self.assign(kwargs)
+        self.invalidate()
+        uow.defer(lambda conn: self._update(conn, self.id, kwargs))
+
+    @classmethod
+    async def query(cls, order_by="id", **kwargs):
+        async with connection() as conn:
+            cur = await conn.cursor(row_factory=cls.row_factory).execute(
+                f"""
+                    SELECT *
+                    FROM {cls.table_name}
+                    WHERE {" AND ".join(f"{name}=%({name})s" for name in kwargs)}
+                    ORDER BY {order_by}
+                """,
+                kwargs,
             )
+            return [cls.mapped(entity) async for entity in cur]
 
     @classmethod
-    def query(cls, order_by="id", **kwargs):
-        with psycopg.connect(DB_SPEC, row_factory=dict_row) as conn:
-            return [
-                cls(row)
-                for row in conn.execute(
-                    f"""
-                        SELECT *
-                        FROM {cls.table_name}
-                        WHERE {", ".join(f"{name}=%({name})s" for name in kwargs)}
-                        ORDER BY {order_by}
-                    """,
-                    kwargs,
-                )
-            ]
+    async def page(cls, limit, after=0, **kwargs):
+        # Keyset pagination: the first `limit` rows with an id above `after`.
+        async with connection() as conn:
+            cur = await conn.cursor(row_factory=cls.row_factory).execute(
+                f"""
+                    SELECT *
+                    FROM {cls.table_name}
+                    WHERE {" AND ".join(
+                        ["id>%(after)s", *(f"{name}=%({name})s" for name in kwargs)]
+                    )}
+                    ORDER BY id
+                    LIMIT %(limit)s
+                """,
+                {"limit": limit, "after": after, **kwargs},
+            )
+            return [cls.mapped(entity) async for entity in cur]
+
+
+def etag(*revisions):
+    # weak, because the same revision may be sent with different encodings
+    return f'W/"{".".join(map(str, revisions))}"'
 
 
 class Runbook(Entity):
-    def rename(self, new_name):
-        self.mutate(name=new_name)
+    columns = ("id", "name", "revision", "tree_revision")
+    __slots__ = columns + ("sections", "runs", "run_count")
+    touch = "UPDATE runbooks SET revision=revision+1 WHERE id=%(id)s"
+
+    @classmethod
+    async def list_etag(cls):
+        # Revisions only grow and ids are never reused: a runbook replacing
+        # a deleted one at the same revision still changes max(id).
+        async with connection() as conn:
+            cur = await conn.execute(
+                """
+                    SELECT
+                        count(*) AS count,
+                        max(id) AS last_id,
+                        sum(revision) AS revisions
+                    FROM runbooks
+                """
+            )
+            row = await cur.fetchone()
+        return etag(row["count"], row["last_id"] or 0, row["revisions"] or 0)
+
+    @classmethod
+    async def etag(cls, id):
+        async with connection() as conn:
+            cur = await conn.execute(
+                "SELECT revision FROM runbooks WHERE id=%(id)s",
+                {"id": id},
+            )
+            row = await cur.fetchone()
+        return row and etag(row["revision"])
 
-    @property
-    def sections(self):
-        return Section.query(runbook_id=self.id, order_by="rank ASC")
+    async def rename(self, new_name):
+        await self.mutate(name=new_name)
+
+    async def load_tree(self):
+        if not hasattr(self, "sections"):
+            generation = fragments.generation
+            async with connection() as conn:
+                cur = await conn.execute(
+                    f"SELECT ({tree_query('%(id)s')}) AS sections",
+                    {"id": self.id},
+                )
+                self.sections = build_tree(
+                    (await cur.fetchone())["sections"], generation
+                )
+        return self.sections
 
     @staticmethod
     def new_section_input(id):
-        return f"""<input
-            type="text"
-            name="name"
-            placeholder="New section"
-            hx-swap="outerHTML"
-            hx-post="/sections/new/{id}"
-        >
-        """
+        return templates.NEW_SECTION_INPUT(id=id)
 
     @staticmethod
     def new_run_input(id):
-        return f"""<input
-            type="text"
-            name="name"
-            placeholder="New run"
-            hx-swap="outerHTML"
-            hx-post="/runs/new/{id}"
-        >
-        """
+        return templates.NEW_RUN_INPUT(id=id)
 
     @staticmethod
     def new_runbook_input():
-        return """<input
-            type="text"
-            name="name"
-            placeholder="New runbook"
-            hx-swap="outerHTML"
-            hx-post="/runbooks/new"
-        >
-        """
-
-    @property
-    def runs(self):
-        return Run.query(runbook_id=self.id)
+        return templates.NEW_RUNBOOK_INPUT()
+
+    async def fetch_runs(self):
+        self.runs = await Run.query(runbook_id=self.id)
+        self.run_count = len(self.runs)
+        return self.runs
+
+    @staticmethod
+    async def fetch_recent_runs(runbooks, limit):
+        # The number of runs of each runbook and the last `limit` of them,
+        # for a whole listing in one query.
+        async with connection() as conn:
+            cur = await conn.execute(
+                """
+                    SELECT
+                        runbook_id,
+                        count(*) AS count,
+                        coalesce(
+                            jsonb_agg(to_jsonb(runs) - 'number' ORDER BY id)
+                                FILTER (WHERE number <= %(limit)s),
+                            '[]'
+                        ) AS recent
+                    FROM (
+                        SELECT
+                            runs.*,
+                            row_number() OVER (
+                                PARTITION BY runbook_id ORDER BY id DESC
+                            ) AS number
+                        FROM runs
+                        WHERE runbook_id = ANY(%(ids)s)
+                    ) AS runs
+                    GROUP BY runbook_id
+                """,
+                {"ids": [runbook.id for runbook in runbooks], "limit": limit},
+            )
+            rows = {row["runbook_id"]: row async for row in cur}
+        for runbook in runbooks:
+            row = rows.get(runbook.id, {"count": 0, "recent": []})
+            runbook.runs = [Run(run) for run in row["recent"]]
+            runbook.run_count = row["count"]
+
+    def tags(self):
+        tags = super().tags()
+        # runs aren't loaded for the share code
+        for child in self.sections + getattr(self, "runs", []):
+            tags.extend(child.tags())
+        return tags
+
+    @staticmethod
+    def dump_button(id):
+        return templates.DUMP_BUTTON(id=id)
 
     def __format__(self, fmt):
         if fmt == "link":
-            return f"""
-                <a
-                    class="label actionable"
-                    hx-get="/runbooks/{self.id}"
-                    hx-target="#container"
-                    hx-push-url="/_/runbooks/{self.id}"
-                >
-                    {self.name}
-                </a>
-                {self:runs}
-
-            </div>
-            """
+            return templates.RUNBOOK_LINK(
+                id=self.id,
+                name=self.name,
+                runs_html=f"{self:runs}",
+            )
         elif fmt == "runs":
-            return f"""
-                <ul>
-                    {"".join(f"<li>{run:link}</li>" for run in self.runs)}
-                    {self.new_run_input(self.id)}
-                </ul>
-            """
+            return templates.RUNBOOK_RUNS(
+                more_runs_html=f"{self:more_runs}",
+                runs_html="".join(
+                    templates.RUNBOOK_RUN(
+                        link_html=f"{run:link}",
+                        progress_html=f"{run:progress}",
+                    )
+                    for run in self.runs
+                ),
+                new_run_input_html=self.new_run_input(self.id),
+            )
+        elif fmt == "more_runs":
+            if (hidden := self.run_count - len(self.runs)) <= 0:
+                return ""
+            return templates.MORE_RUNS(id=self.id, hidden=hidden)
         elif fmt == "heading":
-            return f"""
-            <h1
-                hx-post="/runbooks/change/{self.id}"
-                hx-swap="none"
-                hx-trigger="input"
-                hx-vals="js:name:event.target.innerHTML"
-                class="editable"
-                contenteditable
-            >{self.name}</h1>
-            """
-
-        elif fmt == "dump_button":
-            return f"""<a
-                hx-get="/runbooks/dump/{self.id}"
-                class="top-right large-icon actionable"
-            >📋</a>"""
+            return templates.RUNBOOK_HEADING(id=self.id, name=self.name)
         elif fmt == "detail":
-            return f"""
-            <a class="noprint" href="/">↰ Runbooks</a><br>
-            {self:heading}
-            {self:dump_button}
-
-            {"\n".join(f"{section:detail}" for section in self.sections)}
-
-            {self.new_section_input(self.id)}
-
-            <hr>
-            {self:runs}
-            """
-        elif fmt == "dump_data":
-            return base64.b85encode(
-                b"\x00" + gzip.compress(
-                    json.dumps(self.dump(), ensure_ascii=True).encode("utf-8"),
+            return templates.RUNBOOK_DETAIL(
+                heading_html=f"{self:heading}",
+                dump_button_html=self.dump_button(self.id),
+                sections_html="\n".join(
+                    section.render_cached("detail", generation=section.generation)
+                    for section in self.sections
                 ),
-            ).decode("utf-8")
+                new_section_input_html=self.new_section_input(self.id),
+                runs_html=f"{self:runs}",
+            )
+        elif fmt == "dump_data":
+            return sharecode.encode(self.dump())
         else:
             raise f"unknown format code {fmt}"
 
     def dump(self):
         return [self.name, [section.dump() for section in self.sections]]
 
+    @staticmethod
+    def decode(code):
+        return sharecode.decode(code)
+
     @classmethod
-    def load(cls, code):
-        a = base64.b85decode(code)
-        version, b = a[0], a[1:]
-        assert version == 0
-        name, sections = json.loads(gzip.decompress(b).decode("utf-8"))
-        runbook = cls.create(name=name)
-        for section_name, items in sections:
-            section = Section.create(name=section_name, runbook_id=runbook.id)
-            for name, type in items:
-                Item.create(name=name, type=type, section_id=section.id)
+    async def load(cls, code):
+        [runbook] = await cls.load_many([code])
         return runbook
 
+    @classmethod
+    async def load_many(cls, codes):
+        # One statement for the whole batch: ids are drawn from the
+        # sequences up front so sections and items can refer to the rows
+        # inserted next to them, and ranks follow the order in the dump.
+        dumps = [cls.decode(code) for code in codes]
+        async with connection(write=True) as conn:
+            cur = await conn.cursor(row_factory=cls.row_factory).execute(
+                """
+                    WITH runbook_data AS (
+                        SELECT
+                            nextval(pg_get_serial_sequence('runbooks', 'id')) AS id,
+                            value,
+                            ordinality
+                        FROM jsonb_array_elements(%(dumps)s) WITH ORDINALITY
+                    ), section_data AS (
+                        SELECT
+                            nextval(pg_get_serial_sequence('sections', 'id')) AS id,
+                            runbook_data.id AS runbook_id,
+                            section.value,
+                            section.ordinality
+                        FROM runbook_data,
+                            jsonb_array_elements(runbook_data.value->1)
+                            WITH ORDINALITY AS section
+                    ), new_runbooks AS (
+                        INSERT INTO runbooks (id, name)
+                        SELECT id, value->>0 FROM runbook_data
+                        RETURNING *
+                    ), new_sections AS (
+                        INSERT INTO sections (id, runbook_id, name, rank)
+                        SELECT id, runbook_id, value->>0, ordinality * %(gap)s
+                        FROM section_data
+                    ), new_items AS (
+                        INSERT INTO items (section_id, name, type, rank)
+                        SELECT
+                            section_data.id,
+                            item.value->>0,
+                            (item.value->>1)::itemtype,
+                            item.ordinality * %(gap)s
+                        FROM section_data,
+                            jsonb_array_elements(section_data.value->1)
+                            WITH ORDINALITY AS item
+                    )
+                    SELECT new_runbooks.*
+                    FROM new_runbooks
+                    JOIN runbook_data USING (id)
+                    ORDER BY runbook_data.ordinality
+                """,
+                {"dumps": Jsonb(dumps), "gap": Ranked.gap},
+            )
+            return [cls.mapped(entity) async for entity in cur]
+
     @staticmethod
     def load_input():
-        return """<input
-            hx-post="/runbooks/load"
-            hx-target="#container"
-            hx-trigger="keydown[key=='Enter']"
-            class="top-right"
-            name="code"
-            placeholder="Enter share code"
-        >"""
+        return templates.LOAD_INPUT()
+
+
+class Ranked(Entity):
+    """Rows ordered by (rank, id) among the children of their parent.
 
+    Ranks are spaced `gap` apart (see migration 0006). A move gives the row
+    the rank halfway between its new neighbours, so it writes that row
+    only; when they are adjacent the siblings are renumbered first, and
+    when the gaps around it get small they are renumbered in the
+    background.
+    """
 
-class Section(Entity):
-    @property
-    def items(self):
-        return Item.query(section_id=self.id, order_by="rank ASC")
+    __slots__ = ()
+    gap = 1024
+    min_gap = 16
+    renumbering = {}  # (table_name, parent id) -> task
 
-    def rename(self, new_name):
-        self.mutate(name=new_name)
+    @classmethod
+    async def move(cls, id, before=None, parent_id=None):
+        # Put row `id` right before its sibling `before` (last if None),
+        # under `parent_id` (its current parent if None).
+        params = {"id": id, "before": before, "parent_id": parent_id}
+        async with connection(write=True) as conn:
+            if (row := await cls._move(conn, params)) is None:
+                await cls._renumber(conn, params)
+                if (row := await cls._move(conn, params)) is None:
+                    return None
+            entity = cls({name: row[name] for name in cls.columns})
+            old_parent_id = row["old_parent_id"]
+            if cls.touch:
+                await conn.execute(cls.touch, entity.row())
+                if old_parent_id != row[cls.parent]:
+                    await conn.execute(
+                        cls.touch, {**entity.row(), cls.parent: old_parent_id}
+                    )
+        entity.invalidate()
+        fragments.invalidate((cls.parent.removesuffix("_id") + "s", old_parent_id))
+        lower, upper = row["lower"], row["upper"]
+        if min(
+            entity.rank - lower if lower is not None else cls.gap,
+            upper - entity.rank if upper is not None else cls.gap,
+        ) < cls.min_gap:
+            cls.renumber_later(getattr(entity, cls.parent))
+        return cls.mapped(entity)
+
+    @classmethod
+    async def _move(cls, conn, params):
+        # Nothing is written when there is no room between the neighbours.
+        # The parent is only set when given: for items that would run the
+        # progress triggers.
+        table, parent = cls.table_name, cls.parent
+        set_parent = "" if params["parent_id"] is None else f"{parent}=moved.parent_id,"
+        cur = await conn.execute(
+            f"""
+                WITH moved AS (
+                    SELECT
+                        id,
+                        coalesce(%(parent_id)s::integer, {parent}) AS parent_id,
+                        {parent} AS old_parent_id
+                    FROM {table}
+                    WHERE id=%(id)s
+                ), bounds AS (
+                    SELECT
+                        upper.rank AS upper,
+                        (
+                            SELECT max(siblings.rank)
+                            FROM {table} AS siblings
+                            WHERE siblings.{parent}=moved.parent_id
+                                AND siblings.id<>moved.id
+                                AND (
+                                    upper.id IS NULL
+                                    OR (siblings.rank, siblings.id)
+                                        < (upper.rank, upper.id)
+                                )
+                        ) AS lower
+                    FROM moved
+                    LEFT JOIN {table} AS upper
+                        ON upper.id=%(before)s::integer
+                        AND upper.{parent}=moved.parent_id
+                        AND upper.id<>moved.id
+                )
+                UPDATE {table} SET
+                    {set_parent}
+                    rank=CASE
+                        WHEN bounds.upper IS NULL
+                            THEN coalesce(bounds.lower, 0) + %(gap)s
+                        WHEN bounds.lower IS NULL THEN bounds.upper - %(gap)s
+                        ELSE (bounds.lower + bounds.upper) / 2
+                    END
+                FROM moved, bounds
+                WHERE {table}.id=moved.id
+                    AND (
+                        bounds.upper IS NULL
+                        OR bounds.lower IS NULL
+                        OR bounds.upper - bounds.lower >= 2
+                    )
+                RETURNING {table}.*, moved.old_parent_id, bounds.lower, bounds.upper
+            """,
+            {**params, "gap": cls.gap},
+        )
+        return await cur.fetchone()
+
+    @classmethod
+    async def _renumber(cls, conn, params):
+        # Space the siblings `gap` apart again, keeping their order.
+        table, parent = cls.table_name, cls.parent
+        await conn.execute(
+            f"""
+                UPDATE {table} SET rank=ordered.position * %(gap)s
+                FROM (
+                    SELECT
+                        id,
+                        row_number() OVER (ORDER BY rank, id) AS position
+                    FROM {table}
+                    WHERE {parent}=coalesce(
+                        %(parent_id)s::integer,
+                        (SELECT {parent} FROM {table} WHERE id=%(id)s)
+                    )
+                ) AS ordered
+                WHERE {table}.id=ordered.id
+                    AND {table}.rank IS DISTINCT FROM ordered.position * %(gap)s
+            """,
+            {"id": params.get("id"), "parent_id": params["parent_id"], "gap": cls.gap},
+        )
+
+    @classmethod
+    def renumber_later(cls, parent_id):
+        # Once the move is committed: renumbering reads the ranks it wrote.
+        if (uow := unit_of_work.get()) is not None:
+            uow.after_commit(lambda: cls._schedule_renumber(parent_id))
+        else:
+            cls._schedule_renumber(parent_id)
+
+    @classmethod
+    def _schedule_renumber(cls, parent_id):
+        key = cls.table_name, parent_id
+        if key not in cls.renumbering:
+            # A fresh context: this is not part of the request that noticed
+            # the gaps getting small.
+            cls.renumbering[key] = asyncio.create_task(
+                cls._renumber_now(key),
+                context=contextvars.Context(),
+            )
+
+    @classmethod
+    async def _renumber_now(cls, key):
+        _, parent_id = key
+        try:
+            async with pool.connection() as conn:
+                # A move committed meanwhile makes this fail rather than
+                # write ranks computed from the order before it.
+                await conn.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                await cls._renumber(conn, {"parent_id": parent_id})
+        except SerializationFailure:
+            logger.info("Renumbering the %s of %s raced with a move", *key)
+        except Exception:
+            logger.exception("Could not renumber the %s of %s", *key)
+        finally:
+            del cls.renumbering[key]
+
+    @classmethod
+    async def drain(cls):
+        await asyncio.gather(*cls.renumbering.values())
+
+
+class Section(Ranked):
+    columns = ("id", "runbook_id", "name", "rank")
+    __slots__ = columns + ("items", "generation")
+    parent = "runbook_id"
+    touch = """
+        UPDATE runbooks SET revision=revision+1, tree_revision=tree_revision+1
+        WHERE id=%(runbook_id)s
+    """
+
+    def tags(self):
+        tags = super().tags()
+        for item in self.items:
+            tags.extend(item.tags())
+        return tags
+
+    async def rename(self, new_name):
+        await self.mutate(name=new_name)
 
     @staticmethod
     def new_item_input(id, focus=False):
-        return f"""<input
-            type="text"
-            name="name"
-            placeholder="New item"
-            hx-swap="outerHTML"
-            hx-post="/items/new/{id}"
-            {"autofocus" if focus else ""}
-        >"""
+        return templates.NEW_ITEM_INPUT(
+            id=id,
+            autofocus_html="autofocus" if focus else "",
+        )
 
     def __format__(self, fmt):
         if fmt == "heading":
-            return f"""
-            <h2
-                hx-post="/sections/change/{self.id}"
-                hx-swap="none"
-                hx-trigger="input"
-                hx-vals="js:name:event.target.innerHTML"
-                class="editable"
-                contenteditable
-            >{self.name}</h2>
-            """
-
+            return templates.SECTION_HEADING(id=self.id, name=self.name)
         elif fmt == "detail":
-            return f"""
-            <section>
-            {self:heading}
-
-            <ul>
-            {"\n".join(f"{item:detail}" for item in self.items)}
-            {self:additem}
-            </ul>
-            </section>
-            """
+            return templates.SECTION_DETAIL(
+                id=self.id,
+                heading_html=f"{self:heading}",
+                items_html="\n".join(
+                    item.render_cached("detail", generation=self.generation)
+                    for item in self.items
+                ),
+                new_item_input_html=f"{self:additem}",
+            )
         elif fmt == "additem":
             return self.new_item_input(self.id)
 
@@ -274,27 +823,23 @@ class Section(Entity):
         return [self.name, [item.dump() for item in self.items]]
 
 
-class Item(Entity):
+class Item(Ranked):
+    columns = ("id", "section_id", "name", "type", "rank")
+    __slots__ = columns
+    parent = "section_id"
+    touch = """
+        UPDATE runbooks SET revision=revision+1, tree_revision=tree_revision+1
+        WHERE id=(SELECT runbook_id FROM sections WHERE id=%(section_id)s)
+    """
+
     def __format__(self, fmt):
         if fmt == "detail":
-            return f"""
-                <li>
-                    <span
-                        hx-post="/items/toggle/{self.id}"
-                        hx-swap="outerHTML"
-                        hx-target="closest li"
-                        class="actionable type type-{self.type}"
-                    >{self:type}</span>
-                    <span
-                        hx-post="/items/change/{self.id}"
-                        hx-swap="none"
-                        hx-trigger="input"
-                        hx-vals="js:name:event.target.innerHTML"
-                        class="editable"
-                        contenteditable
-                    >{self.name}</span>
-                </li>
-            """
+            return templates.ITEM_DETAIL(
+                id=self.id,
+                type=self.type,
+                symbol=f"{self:type}",
+                name=self.name,
+            )
         elif fmt == "type":
             if self.type == "each":
                 return "∀"
@@ -312,216 +857,482 @@ class Item(Entity):
     def as_checkbox(self, run, checked):
         # checked is a dict like {None: "normal"|"not applicable"}
         if self.type == "once":
-            classes = self.css_classes(checked.get(None))
-
-            return f"""
-                <li
-                    hx-post="/checkmarks/check/{run.id}/{self.id}"
-                    hx-swap="outerHTML"
-                    hx-trigger="click[!ctrlKey]"
-                    class="{classes}"
-                >{self.name}
-                    <span
-                        hx-post="/checkmarks/disable/{run.id}/{self.id}"
-                        hx-swap="outerHTML"
-                        hx-target="closest li"
-                        hx-trigger="click[ctrlKey] from:closest li"
-                    ></span>
-                </li>
-            """
-        else:
-            if len(checked) == len(run.targets):
-                extra_class = " checked"
-            else:
-                extra_class = ""
-            return f"""
-                <li class="multi{extra_class}">{self.name}
-                <ul>
-                {"\n".join(
-                    f'''<li
-                        class="{self.css_classes(checked.get(target.id))}"
-                        hx-post="/checkmarks/check/{run.id}/{self.id}/{target.id}"
-                        hx-swap="outerHTML"
-                        hx-target="closest li.multi"
-                        hx-trigger="click[!ctrlKey]"
-                    >
-                    <span
-                        hx-post="/checkmarks/disable/{run.id}/{self.id}/{target.id}"
-                        hx-swap="outerHTML"
-                        hx-target="closest li.multi"
-                        hx-trigger="click[ctrlKey] from:(closest li)"
-                    ></span>
-                    <div
-                        class="multilabel target target-{i}"
-                    >{target.name}</div></li>'''
+            return templates.ONCE_CHECKBOX(
+                run_id=run.id,
+                id=self.id,
+                classes=self.css_classes(checked.get(None)),
+                name=self.name,
+            )
+        return templates.EACH_CHECKBOX(
+            extra_class=" checked" if len(checked) == len(run.targets) else "",
+            id=self.id,
+            name=self.name,
+            targets_html="\n".join(
+                [
+                    templates.TARGET_CHECKBOX(
+                        classes=self.css_classes(checked.get(target.id)),
+                        run_id=run.id,
+                        id=self.id,
+                        target_id=target.id,
+                        i=i,
+                        target_name=target.name,
+                    )
                     for i, target in enumerate(run.targets)
-                )}
-                </ul>
-                </li>
-            """
+                ]
+            ),
+        )
 
-    def toggle(self):
+    async def toggle(self):
         new_type = "once" if self.type == "each" else "each"
-        self.mutate(type=new_type)
-
-    def check_for(self, run, target_id=None, disable=False):
-        type = "not applicable" if disable else "normal"
-        with psycopg.connect(DB_SPEC, row_factory=dict_row) as conn:
-            checked_target_ids = [
-                row["target_id"]
-                for row in conn.execute(
-                    """
-                        SELECT *
-                        FROM checkmarks
-                        WHERE run_id=%(run_id)s AND item_id=%(item_id)s
-                    """,
-                    {"run_id": run.id, "item_id": self.id},
-                ).fetchall()
-            ]
-            if self.type == "once":
-                if checked_target_ids:
-                    conn.execute(
-                        f"""
-                            DELETE FROM checkmarks
-                            WHERE run_id=%(run_id)s AND item_id=%(item_id)s
-                            {"" if disable else "AND type <> 'not applicable'"}
-                        """,
-                        {"run_id": run.id, "item_id": self.id},
-                    )
-                else:
-                    conn.execute(
-                        """
-                            INSERT INTO checkmarks (run_id, item_id, type)
-                            VALUES (%(run_id)s, %(item_id)s, %(type)s)
-                        """,
-                        {
-                            "run_id": run.id,
-                            "item_id": self.id,
-                            "type": type,
-                        },
-                    )
-            else:
-                if target_id in checked_target_ids:
-                    conn.execute(
-                        f"""
-                            DELETE FROM checkmarks
-                            WHERE run_id=%(run_id)s
-                                AND item_id=%(item_id)s
-                                AND target_id=%(target_id)s
-                            {"" if disable else "AND type <> 'not applicable'"}
-                        """,
-                        {
-                            "run_id": run.id,
-                            "item_id": self.id,
-                            "target_id": target_id,
-                        },
+        await self.mutate(type=new_type)
+
+    @classmethod
+    async def check(cls, run_id, item_id, target_id=None, disable=False):
+        # Flip the checkmark and read back the item's new state in a single
+        # statement. The data-modifying CTEs aren't visible to the final
+        # SELECT, so the new state is the old rows minus "deleted" plus
+        # "inserted"; the unique index turns a concurrent duplicate insert
+        # into a no-op. Returns None, writing nothing, when the item or the
+        # run is missing or the run is completed.
+        async with connection(write=True) as conn:
+            cur = await conn.execute(
+                f"""
+                    WITH item AS (
+                        -- waits for a run being completed, see Run.complete()
+                        SELECT items.*
+                        FROM items, runs
+                        WHERE items.id=%(item_id)s
+                            AND runs.id=%(run_id)s
+                            AND runs.completed_at IS NULL
+                        FOR NO KEY UPDATE OF runs
+                    ), existing AS (
+                        SELECT checkmarks.id
+                        FROM checkmarks, item
+                        WHERE checkmarks.run_id=%(run_id)s
+                            AND checkmarks.item_id=item.id
+                            AND (
+                                item.type='once'
+                                OR checkmarks.target_id IS NOT DISTINCT FROM %(target_id)s::integer
+                            )
+                    ), deleted AS (
+                        DELETE FROM checkmarks
+                        WHERE id IN (SELECT id FROM existing)
+                        {"" if disable else "AND type <> 'not applicable'"}
+                        RETURNING id
+                    ), inserted AS (
+                        INSERT INTO checkmarks (run_id, item_id, target_id, type)
+                        SELECT
+                            %(run_id)s,
+                            item.id,
+                            CASE WHEN item.type='each' THEN %(target_id)s::integer END,
+                            %(type)s::checktype
+                        FROM item
+                        WHERE NOT EXISTS (SELECT FROM existing)
+                        ON CONFLICT (run_id, item_id, target_id) DO NOTHING
+                        RETURNING target_id, type
+                    ), touched AS (
+                        UPDATE runs SET revision=revision+1
+                        WHERE id=%(run_id)s AND EXISTS (SELECT FROM item)
+                        RETURNING runbook_id, pg_notify('run_updates', jsonb_build_object(
+                            'run_id', id,
+                            'item_id', %(item_id)s::integer
+                        )::text)
+                    ), touched_runbook AS (
+                        -- for the progress of the run on the runbook's pages;
+                        -- the runbook's page is rendered anew after every
+                        -- check, but its tree_revision stays, and with it the
+                        -- ETags of the other runs (see Run.version)
+                        UPDATE runbooks SET revision=revision+1
+                        WHERE id IN (SELECT runbook_id FROM touched)
                     )
-                else:
-                    conn.execute(
-                        """
-                            INSERT INTO checkmarks (run_id, item_id, target_id, type)
-                            VALUES (%(run_id)s, %(item_id)s, %(target_id)s, %(type)s)
-                        """,
-                        {
-                            "run_id": run.id,
-                            "item_id": self.id,
-                            "target_id": target_id,
-                            "type": type,
-                        },
+                    {checkbox_query("""
+                        SELECT target_id, type
+                        FROM checkmarks
+                        WHERE run_id=%(run_id)s
+                            AND item_id=item.id
+                            AND id NOT IN (SELECT id FROM deleted)
+                        UNION ALL
+                        SELECT target_id, type FROM inserted
+                    """)}
+                """,
+                {
+                    "run_id": run_id,
+                    "item_id": item_id,
+                    "target_id": target_id,
+                    "type": "not applicable" if disable else "normal",
+                },
+            )
+            if (row := await cur.fetchone()) is None:
+                return None
+            return cls.checkbox_from_row(row)
+
+    @classmethod
+    async def checkbox(cls, run_id, item_id):
+        async with connection() as conn:
+            cur = await conn.execute(
+                f"""
+                    WITH item AS (
+                        SELECT * FROM items WHERE id=%(item_id)s
                     )
-            conn.commit()
-            return self.as_checkbox(run, run.get_checked().get(self.id, {}))
+                    {checkbox_query("""
+                        SELECT target_id, type
+                        FROM checkmarks
+                        WHERE run_id=%(run_id)s AND item_id=item.id
+                    """)}
+                """,
+                {"run_id": run_id, "item_id": item_id},
+            )
+            return cls.checkbox_from_row(await cur.fetchone())
 
-    def rename(self, new_name):
-        self.mutate(name=new_name)
+    @classmethod
+    def checkbox_from_row(cls, row):
+        item = cls(row["item"])
+        run = Run(row["run"])
+        run.targets = [Target(target) for target in row["targets"]]
+        checked = {
+            checkmark["target_id"]: checkmark["type"]
+            for checkmark in row["checkmarks"]
+        }
+        return item.as_checkbox(run, checked)
+
+    async def rename(self, new_name):
+        await self.mutate(name=new_name)
 
     def dump(self):
         return [self.name, self.type]
 
 
 class Run(Entity):
+    columns = (
+        "id",
+        "runbook_id",
+        "name",
+        "revision",
+        # maintained by triggers, see migrations/0004_run_progress.sql
+        "slot_count",
+        "checked_count",
+        "skipped_count",
+        # set by complete()
+        "completed_at",
+    )
+    __slots__ = columns + ("runbook", "targets", "checked")
+    parent = "runbook_id"
+    # runs are listed on their runbook's page
+    touch = """
+        WITH run AS (
+            UPDATE runs SET revision=revision+1 WHERE id=%(id)s
+        )
+        UPDATE runbooks SET revision=revision+1 WHERE id=%(runbook_id)s
+    """
+
+    @classmethod
+    async def version(cls, id):
+        # (ETag, completed) of the run, (None, False) if there is none. The
+        # checklist of a live run shows the runbook's current sections and
+        # items too, but not the progress of its other runs; that of a
+        # completed one is stored.
+        async with connection() as conn:
+            cur = await conn.execute(
+                """
+                    SELECT
+                        runs.revision,
+                        runbooks.tree_revision,
+                        runs.completed_at
+                    FROM runs
+                    JOIN runbooks ON runbooks.id=runs.runbook_id
+                    WHERE runs.id=%(id)s
+                """,
+                {"id": id},
+            )
+            row = await cur.fetchone()
+        if row is None:
+            return None, False
+        if row["completed_at"] is not None:
+            return etag(row["revision"]), True
+        return etag(row["revision"], row["tree_revision"]), False
+
     def __format__(self, fmt):
         if fmt == "link":
-            return f"""
-            <a
-                class="label actionable"
-                hx-get="/runs/{self.id}"
-                hx-target="#container"
-                hx-push-url="/_/runs/{self.id}"
-            >
-                {self.name}
-            </a>
-            """
+            return templates.RUN_LINK(id=self.id, name=self.name)
+        elif fmt == "progress":
+            if not self.slot_count:
+                return ""
+            return templates.RUN_PROGRESS(
+                slot_count=self.slot_count,
+                done=self.checked_count + self.skipped_count,
+            )
         elif fmt == "heading":
-            return f"""
-            <h1
-                hx-post="/runs/change/{self.id}"
-                hx-swap="none"
-                hx-trigger="input"
-                hx-vals="js:name:event.target.innerHTML"
-                class="editable"
-                contenteditable
-            >{self.name}</h1>
-            """
+            return templates.RUN_HEADING(id=self.id, name=self.name)
         elif fmt == "targets":
-            return f"""<div class="targets noprint">
-                Targets: {"\n".join(
-                    f'<span class="target target-{i}">{target:full}</span>'
-                    for i, target in enumerate(self.targets)
-                )}
-                {self.new_target_input()}
-            </div>
-            """
+            return self.targets_bar()
         elif fmt == "detail":
-            checked = self.get_checked()
+            rows = self.header_rows()
+            for section in self.runbook.sections:
+                rows.extend(self.section_rows(section, self.checked))
+            rows.append("</div>")
+            return "\n".join(rows)
+        elif fmt == "snapshot":
+            # read-only, as stored by complete()
             rows = [
-                '<a class="noprint" href="/">↰ Runbooks</a><br>',
-                f"{self:heading}",
-                f"{self:targets}",
+                templates.RUN_SNAPSHOT(),
+                templates.BACK_LINK(),
+                templates.RUN_TITLE(name=self.name),
+                templates.RUN_TARGETS(
+                    targets_html=self.target_labels(),
+                    new_target_input_html="",
+                ),
             ]
-            for section in Runbook.from_id(self.runbook_id).sections:
-                rows.append(f"<section><h2>{section.name}</h2><ul>")
-                for item in section.items:
-                    rows.append(item.as_checkbox(self, checked.get(item.id, {})))
-                rows.append("</ul></section>")
+            for section in self.runbook.sections:
+                rows.extend(self.section_rows(section, self.checked))
+            rows.append("</div>")
             return "\n".join(rows)
 
-    def rename(self, new_name):
-        self.mutate(name=new_name)
+    def targets_bar(self):
+        return templates.RUN_TARGETS(
+            targets_html=self.target_labels(),
+            new_target_input_html=self.new_target_input(),
+        )
+
+    def target_labels(self):
+        return "\n".join(
+            templates.TARGET_LABEL(i=i, name=f"{target:full}")
+            for i, target in enumerate(self.targets)
+        )
+
+    def header_rows(self):
+        # The detail is wrapped in the event stream of the run: checkmarks
+        # and targets added elsewhere replace their elements in place.
+        return [
+            templates.RUN_EVENTS(id=self.id),
+            templates.BACK_LINK(),
+            templates.COMPLETE_BUTTON(id=self.id),
+            f"{self:heading}",
+            f"{self:targets}",
+        ]
+
+    def section_rows(self, section, checked):
+        rows = [templates.RUN_SECTION_START(name=section.name)]
+        for item in section.items:
+            rows.append(item.as_checkbox(self, checked.get(item.id, {})))
+        rows.append("</ul></section>")
+        return rows
+
+    @classmethod
+    async def stream_detail(cls, id):
+        # Same output as format(run, "detail"), yielded section by section.
+        # Items and their checkmarks come from a server-side cursor, so only
+        # the section being rendered is held in memory.
+        async with connection() as conn:
+            cur = await conn.execute(
+                """
+                    SELECT
+                        to_jsonb(runs) AS run,
+                        (
+                            SELECT coalesce(jsonb_agg(targets ORDER BY targets.id), '[]')
+                            FROM targets
+                            WHERE targets.run_id=runs.id
+                        ) AS targets
+                    FROM runs
+                    WHERE runs.id=%(id)s
+                """,
+                {"id": id},
+            )
+            row = await cur.fetchone()
+            run = cls(row["run"])
+            run.targets = [Target(target) for target in row["targets"]]
+            yield "\n".join(run.header_rows())
+
+            async with conn.transaction(), conn.cursor(name="run_detail") as cur:
+                await cur.execute(
+                    """
+                        SELECT
+                            to_jsonb(sections) AS section,
+                            to_jsonb(items) AS item,
+                            (
+                                SELECT coalesce(jsonb_agg(jsonb_build_object(
+                                    'target_id', target_id,
+                                    'type', type
+                                )), '[]')
+                                FROM checkmarks
+                                WHERE checkmarks.run_id=%(id)s
+                                    AND checkmarks.item_id=items.id
+                            ) AS checkmarks
+                        FROM sections
+                        LEFT JOIN items ON items.section_id=sections.id
+                        WHERE sections.runbook_id=%(runbook_id)s
+                        ORDER BY sections.rank, sections.id, items.rank, items.id
+                    """,
+                    {"id": id, "runbook_id": run.runbook_id},
+                )
+                section = None
+                async for row in cur:
+                    if section is None or row["section"]["id"] != section.id:
+                        if section is not None:
+                            yield "\n" + "\n".join(run.section_rows(section, checked))
+                        section = Section(row["section"])
+                        section.items = []
+                        checked = {}
+                    if row["item"] is None:
+                        continue  # empty section
+                    item = Item(row["item"])
+                    section.items.append(item)
+                    for checkmark in row["checkmarks"]:
+                        checked.setdefault(item.id, {})[
+                            checkmark["target_id"]
+                        ] = checkmark["type"]
+                if section is not None:
+                    yield "\n" + "\n".join(run.section_rows(section, checked))
+            yield "\n</div>"
+
+    @classmethod
+    async def live_messages(cls, update):
+        # (event, html) pairs for the run_updates notification `update`.
+        if update.get("completed"):
+            body = await cls.snapshot(update["run_id"])
+            return [("completed", gzip.decompress(body).decode("utf-8"))]
+        if (item_id := update.get("item_id")) is not None:
+            return [(f"item-{item_id}", await Item.checkbox(update["run_id"], item_id))]
+        # A new target adds a column to every "each" item.
+        run = await cls.load_detail(update["run_id"])
+        messages = [("targets", run.target_labels())]
+        for section in run.runbook.sections:
+            for item in section.items:
+                if item.type != "once":
+                    messages.append(
+                        (
+                            f"item-{item.id}",
+                            item.as_checkbox(run, run.checked.get(item.id, {})),
+                        )
+                    )
+        return messages
+
+    async def rename(self, new_name):
+        await self.mutate(name=new_name)
 
-    def get_checked(self):
-        checked = {}
-        with psycopg.connect(DB_SPEC) as conn:
-            for target_id, item_id, type in conn.execute(
+    @classmethod
+    async def complete(cls, id):
+        # Freeze the run: store its rendering, and the tree it was rendered
+        # from, in run_snapshots and delete its checkmarks. Returns the
+        # rendering, or None if the run is missing or already completed.
+        async with connection(write=True) as conn:
+            # The run's row stays locked until commit: checks wait for it,
+            # then find the run completed.
+            cur = await conn.execute(
+                """
+                    UPDATE runs SET completed_at=now(), revision=revision+1
+                    WHERE id=%(id)s AND completed_at IS NULL
+                    RETURNING id
+                """,
+                {"id": id},
+            )
+            if await cur.fetchone() is None:
+                return None
+            tree = await cls.fetch_detail(id)
+            body = format(cls.from_detail(tree), "snapshot")
+            # Live viewers swap in the snapshot (see live_messages).
+            await conn.execute(
                 """
-                    SELECT target_id, item_id, type
-                    FROM checkmarks
-                    WHERE run_id=%(run_id)s
+                    WITH snapshot AS (
+                        INSERT INTO run_snapshots (run_id, tree, html)
+                        VALUES (%(id)s, %(tree)s, %(html)s)
+                    ), pruned AS (
+                        DELETE FROM checkmarks WHERE run_id=%(id)s
+                    )
+                    SELECT pg_notify('run_updates', jsonb_build_object(
+                        'run_id', %(id)s::integer,
+                        'completed', true
+                    )::text)
                 """,
                 {
-                    "run_id": self.id,
+                    "id": id,
+                    "tree": Jsonb(tree),
+                    "html": gzip.compress(body.encode("utf-8"), 9, mtime=0),
                 },
-            ).fetchall():
-                checked.setdefault(item_id, {})[target_id] = type
-        return checked
+            )
+        return body
 
-    @property
-    def targets(self):
-        return Target.query(run_id=self.id)
+    @staticmethod
+    async def snapshot(id):
+        # The stored rendering of a completed run, gzip-compressed.
+        async with connection() as conn:
+            cur = await conn.execute(
+                "SELECT html FROM run_snapshots WHERE run_id=%(id)s",
+                {"id": id},
+            )
+            row = await cur.fetchone()
+        return row and row["html"]
+
+    @classmethod
+    async def load_detail(cls, id):
+        return cls.from_detail(await cls.fetch_detail(id))
+
+    @staticmethod
+    async def fetch_detail(id):
+        # Everything the detail view needs, in a single round trip: the run,
+        # its runbook with the ordered section/item tree, targets and
+        # checkmarks.
+        async with connection() as conn:
+            cur = await conn.execute(
+                f"""
+                    SELECT
+                        to_jsonb(runs) AS run,
+                        to_jsonb(runbooks) AS runbook,
+                        ({tree_query("runs.runbook_id")}) AS sections,
+                        (
+                            SELECT coalesce(jsonb_agg(targets ORDER BY targets.id), '[]')
+                            FROM targets
+                            WHERE targets.run_id=runs.id
+                        ) AS targets,
+                        (
+                            SELECT coalesce(jsonb_agg(jsonb_build_object(
+                                'item_id', item_id,
+                                'target_id', target_id,
+                                'type', type
+                            )), '[]')
+                            FROM checkmarks
+                            WHERE checkmarks.run_id=runs.id
+                        ) AS checkmarks
+                    FROM runs
+                    JOIN runbooks ON runbooks.id=runs.runbook_id
+                    WHERE runs.id=%(id)s
+                """,
+                {"id": id},
+            )
+            return await cur.fetchone()
+
+    @classmethod
+    def from_detail(cls, row):
+        run = cls(row["run"])
+        run.runbook = Runbook(row["runbook"])
+        run.runbook.sections = build_tree(row["sections"])
+        run.targets = [Target(target) for target in row["targets"]]
+        run.checked = {}
+        for checkmark in row["checkmarks"]:
+            run.checked.setdefault(checkmark["item_id"], {})[
+                checkmark["target_id"]
+            ] = checkmark["type"]
+        return run
 
     def new_target_input(self):
-        return f"""<input
-            type="text"
-            name="name"
-            placeholder="New target"
-            hx-target="#container"
-            hx-post="/targets/new/{self.id}"
-            autofocus
-        >
-        """
+        return templates.NEW_TARGET_INPUT(id=self.id)
 
 
 class Target(Entity):
+    columns = ("id", "run_id", "name")
+    __slots__ = columns
+    parent = "run_id"
+    touch = """
+        WITH run AS (
+            UPDATE runs SET revision=revision+1 WHERE id=%(run_id)s
+            RETURNING runbook_id, pg_notify(
+                'run_updates',
+                jsonb_build_object('run_id', id)::text
+            )
+        )
+        UPDATE runbooks SET revision=revision+1
+        WHERE id IN (SELECT runbook_id FROM run)
+    """
+
     def __format__(self, fmt):
         if fmt == "full":
             return self.name
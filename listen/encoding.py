@@ -0,0 +1,137 @@
+import gzip
+import zlib
+from .assets import negotiate
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+COMPRESSIBLE = ("text/", "application/json", "application/javascript", "image/svg")
+
+
+class GzipStream:
+    def __init__(self, level):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self.compressor.compress(data) + self.compressor.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class BrotliStream:
+    def __init__(self, quality):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self.compressor.process(data) + self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+class ZstdStream:
+    def __init__(self, level):
+        self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self.compressor.compress(data) + self.compressor.flush(
+            zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        )
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class CompressedStream:
+    """A streaming response whose chunks are compressed as they are sent.
+
+    Every chunk is flushed, so the client can use it right away (a section
+    of a run, an event) at some cost in compression ratio.
+    """
+
+    def __init__(self, response, stream):
+        self.response = response
+        self.stream = stream
+
+    async def send(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        await self.response.send(self.stream.compress(data))
+
+    async def eof(self):
+        await self.response.send(self.stream.finish())
+        await self.response.eof()
+
+
+class Compression:
+    """Content-Encoding negotiation for the responses of the app.
+
+    Encodings whose module isn't installed are not offered; of those the
+    client accepts equally, the first of `preference` wins.
+    """
+
+    preference = ("br", "zstd", "gzip")
+
+    def __init__(self, min_size=1024, gzip_level=6, brotli_quality=4, zstd_level=3):
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.zstd_level = zstd_level
+        available = {"br": brotli, "zstd": zstandard, "gzip": gzip}
+        self.encodings = [name for name in self.preference if available[name]]
+
+    def choose(self, request, response):
+        # The encoding for `response`, or None to send it as it is.
+        if "content-encoding" in response.headers:
+            return None
+        if not (response.content_type or "").startswith(COMPRESSIBLE):
+            return None
+        response.headers["Vary"] = "Accept-Encoding"
+        accept_encoding = request.headers.get("accept-encoding", "")
+        for encoding in negotiate(accept_encoding, self.encodings):
+            return encoding
+        return None
+
+    def compress(self, request, response):
+        if not response.body or len(response.body) < self.min_size:
+            return
+        if (encoding := self.choose(request, response)) is None:
+            return
+        if encoding == "br":
+            body = brotli.compress(response.body, quality=self.brotli_quality)
+        elif encoding == "zstd":
+            body = zstandard.ZstdCompressor(level=self.zstd_level).compress(
+                response.body
+            )
+        else:
+            body = gzip.compress(response.body, self.gzip_level, mtime=0)
+        response.body = body
+        response.headers["Content-Encoding"] = encoding
+
+    def stream(self, request, response):
+        # Wrap a response returned by request.respond(), before anything
+        # was sent.
+        if (encoding := self.choose(request, response)) is None:
+            return response
+        response.headers["Content-Encoding"] = encoding
+        if encoding == "br":
+            stream = BrotliStream(self.brotli_quality)
+        elif encoding == "zstd":
+            stream = ZstdStream(self.zstd_level)
+        else:
+            stream = GzipStream(self.gzip_level)
+        return CompressedStream(response, stream)
+
+
+compression = Compression()
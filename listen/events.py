@@ -0,0 +1,134 @@
+import asyncio
+import contextlib
+import json
+import logging
+import psycopg
+
+
+logger = logging.getLogger(__name__)
+
+
+class Notifications:
+    """LISTEN on the channels of some handlers over one connection.
+
+    Each handler has a `channel`, and gets the JSON payloads sent on it
+    passed to its `dispatch`, in the order they arrive. The connection is
+    reopened when it drops; the handlers' `reconnected` is called then,
+    since whatever was sent in between is lost.
+    """
+
+    def __init__(self, *handlers):
+        self.handlers = {handler.channel: handler for handler in handlers}
+        self.task = None
+
+    def start(self, conninfo):
+        self.task = asyncio.create_task(self._listen(conninfo))
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.task
+
+    async def _listen(self, conninfo):
+        reconnect = False
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(
+                    conninfo,
+                    autocommit=True,
+                ) as conn:
+                    for channel in self.handlers:
+                        await conn.execute(f"LISTEN {channel}")
+                    if reconnect:
+                        for handler in self.handlers.values():
+                            handler.reconnected()
+                    async for notify in conn.notifies():
+                        await self._dispatch(notify)
+            except Exception:
+                logger.exception("Lost the notifications listener, reconnecting")
+                reconnect = True
+                await asyncio.sleep(1)
+
+    async def _dispatch(self, notify):
+        try:
+            payload = json.loads(notify.payload)
+            await self.handlers[notify.channel].dispatch(payload)
+        except Exception:
+            logger.exception(
+                "Could not handle %s notification %r", notify.channel, notify.payload
+            )
+
+
+class Listener:
+    """A handler for the notifications of `channel`; see Notifications."""
+
+    channel = None
+
+    def reconnected(self):
+        pass
+
+    async def dispatch(self, payload):
+        pass
+
+
+class RunUpdates(Listener):
+    """Relay the run_updates notifications to this worker's subscribers.
+
+    Write paths NOTIFY run_updates with {"run_id": ..., "item_id": ...}
+    (item_id is missing when the whole run changed, and replaced by
+    "completed": true once it is completed). Each notification is
+    rendered once, by `render`, into (event, html) pairs that are handed to
+    every subscriber of that run.
+    """
+
+    channel = "run_updates"
+
+    def __init__(self, render):
+        self.render = render
+        self.subscribers = {}  # run_id -> set of asyncio.Queue
+
+    @contextlib.contextmanager
+    def subscribe(self, run_id):
+        queue = asyncio.Queue()
+        self.subscribers.setdefault(run_id, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            self.subscribers[run_id].discard(queue)
+            if not self.subscribers[run_id]:
+                del self.subscribers[run_id]
+
+    async def dispatch(self, update):
+        # Rendered in arrival order, so a slow render can't overtake a
+        # newer state of the same item.
+        if not (queues := self.subscribers.get(update["run_id"])):
+            return
+        try:
+            messages = await self.render(update)
+        except Exception:
+            logger.exception("Could not render run update %s", update)
+            return
+        for queue in queues:
+            queue.put_nowait(messages)
+
+
+class Invalidations(Listener):
+    """Keep this worker's fragment cache in step with the other workers.
+
+    The rows fragments are rendered from NOTIFY invalidations with a JSON
+    array of [table, id] tags whenever they change (see migration 0005),
+    whichever worker or process wrote them.
+    """
+
+    channel = "invalidations"
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def reconnected(self):
+        # Whatever changed while we weren't listening may be cached.
+        self.cache.clear()
+
+    async def dispatch(self, tags):
+        self.cache.invalidate(*(tuple(tag) for tag in tags))
@@ -0,0 +1,57 @@
+import logging
+import sys
+from pathlib import Path
+import psycopg
+from .database import DB_SPEC
+
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = Path(__file__).parent / "migrations"
+
+
+def available():
+    # 0002_foreign_key_indexes.sql -> (2, "foreign_key_indexes", path)
+    for path in sorted(MIGRATIONS.glob("*.sql")):
+        version, _, name = path.stem.partition("_")
+        yield int(version), name, path
+
+
+def migrate(conninfo=DB_SPEC):
+    with psycopg.connect(conninfo, autocommit=True) as conn:
+        # Several workers may start at once; only one of them migrates.
+        conn.execute("SELECT pg_advisory_lock(hashtext('listen.migrate'))")
+        try:
+            conn.execute(
+                """
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                      version INTEGER PRIMARY KEY,
+                      name TEXT,
+                      applied_at TIMESTAMPTZ DEFAULT now()
+                    )
+                """
+            )
+            applied = {
+                version
+                for version, in conn.execute("SELECT version FROM schema_migrations")
+            }
+            for version, name, path in available():
+                if version in applied:
+                    continue
+                with conn.transaction():
+                    conn.execute(path.read_text())
+                    conn.execute(
+                        """
+                            INSERT INTO schema_migrations (version, name)
+                            VALUES (%(version)s, %(name)s)
+                        """,
+                        {"version": version, "name": name},
+                    )
+                logger.info("Applied %s", path.name)
+        finally:
+            conn.execute("SELECT pg_advisory_unlock(hashtext('listen.migrate'))")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    migrate(*sys.argv[1:])
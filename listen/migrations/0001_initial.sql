@@ -0,0 +1,53 @@
+-- The schema formerly created by create-models.py. Everything is guarded so
+-- that databases set up with that script can be brought under version
+-- control without being dropped.
+
+DO $$ BEGIN
+  CREATE TYPE itemtype AS ENUM ('each', 'once');
+EXCEPTION WHEN duplicate_object THEN NULL;
+END $$;
+
+DO $$ BEGIN
+  CREATE TYPE checktype AS ENUM ('normal', 'not applicable');
+EXCEPTION WHEN duplicate_object THEN NULL;
+END $$;
+
+CREATE TABLE IF NOT EXISTS runbooks (
+  id SERIAL PRIMARY KEY,
+  name TEXT
+);
+
+CREATE TABLE IF NOT EXISTS sections (
+  id SERIAL PRIMARY KEY,
+  runbook_id INTEGER REFERENCES runbooks (id) ON DELETE CASCADE,
+  name TEXT,
+  rank INTEGER  -- at which position in the runbook is it?
+);
+
+CREATE TABLE IF NOT EXISTS items (
+  id SERIAL PRIMARY KEY,
+  section_id INTEGER REFERENCES sections (id) ON DELETE CASCADE,
+  name TEXT,
+  type itemtype DEFAULT 'once',
+  rank INTEGER  -- at which position in the section is it?
+);
+
+CREATE TABLE IF NOT EXISTS runs (
+  id SERIAL PRIMARY KEY,
+  runbook_id INTEGER REFERENCES runbooks (id) ON DELETE CASCADE,
+  name TEXT
+);
+
+CREATE TABLE IF NOT EXISTS targets (
+  id SERIAL PRIMARY KEY,
+  run_id INTEGER REFERENCES runs (id) ON DELETE CASCADE,
+  name VARCHAR(16)
+);
+
+CREATE TABLE IF NOT EXISTS checkmarks (
+  id SERIAL PRIMARY KEY,
+  run_id INTEGER REFERENCES runs (id) ON DELETE CASCADE,
+  item_id INTEGER REFERENCES items (id) ON DELETE CASCADE,
+  target_id INTEGER REFERENCES targets (id) ON DELETE CASCADE,
+  type checktype DEFAULT 'normal'
+);
@@ -0,0 +1,25 @@
+-- Indexes for the lookups the application actually does: children by parent
+-- in rank order, and checkmarks by run/item/target.
+
+CREATE INDEX IF NOT EXISTS sections_runbook_id_rank_idx ON sections (runbook_id, rank, id);
+CREATE INDEX IF NOT EXISTS items_section_id_rank_idx ON items (section_id, rank, id);
+CREATE INDEX IF NOT EXISTS runs_runbook_id_idx ON runs (runbook_id);
+CREATE INDEX IF NOT EXISTS targets_run_id_idx ON targets (run_id);
+
+-- Concurrent clicks could insert the same checkmark twice; keep the oldest
+-- row before making that impossible.
+DELETE FROM checkmarks a
+USING checkmarks b
+WHERE a.run_id = b.run_id
+  AND a.item_id = b.item_id
+  AND a.target_id IS NOT DISTINCT FROM b.target_id
+  AND a.id > b.id;
+
+-- "once" items are checked with a NULL target_id, which must still be unique
+-- per run and item (NULLS NOT DISTINCT needs PostgreSQL 15+).
+CREATE UNIQUE INDEX IF NOT EXISTS checkmarks_run_id_item_id_target_id_key
+  ON checkmarks (run_id, item_id, target_id) NULLS NOT DISTINCT;
+
+-- Used by the ON DELETE CASCADE of items and targets.
+CREATE INDEX IF NOT EXISTS checkmarks_item_id_idx ON checkmarks (item_id);
+CREATE INDEX IF NOT EXISTS checkmarks_target_id_idx ON checkmarks (target_id);
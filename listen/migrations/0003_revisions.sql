@@ -0,0 +1,5 @@
+-- Counters bumped by every write that changes how a runbook or run renders;
+-- they make cheap ETags for conditional GETs.
+
+ALTER TABLE runbooks ADD COLUMN IF NOT EXISTS revision INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE runs ADD COLUMN IF NOT EXISTS revision INTEGER NOT NULL DEFAULT 0;
@@ -0,0 +1,203 @@
+-- How far each run is, kept up to date by triggers so that listings don't
+-- have to look at checkmarks at all. A run has one slot per "once" item of
+-- its runbook and one per target for every other item; a checkmark counts
+-- when it fills a slot (checkmarks left behind by a change of the item's
+-- type don't).
+--
+-- Deleting a section, item or target removes its checkmarks by cascade,
+-- after the row itself is gone; so the BEFORE DELETE triggers take the
+-- whole subtree off the counters, and the checkmark trigger ignores rows
+-- whose item or target no longer exists.
+--
+-- Deleting a runbook cascades to its sections and runs in no particular
+-- order, and the section triggers could update a run of the runbook twice
+-- in that statement: the second update would fail the foreign key check of
+-- the runbook already gone. Runs are joined through their runbook, so
+-- those of a deleted runbook are left alone.
+--
+-- Runbook pages show the progress of the runs, so every checkmark bumps
+-- the runbook's revision. Run checklists only show its sections and items:
+-- tree_revision counts the changes to those, and checking an item in one
+-- run leaves the ETags of the others as they were.
+
+ALTER TABLE runbooks
+  ADD COLUMN IF NOT EXISTS tree_revision INTEGER NOT NULL DEFAULT 0;
+
+ALTER TABLE runs
+  ADD COLUMN IF NOT EXISTS slot_count INTEGER NOT NULL DEFAULT 0,
+  ADD COLUMN IF NOT EXISTS checked_count INTEGER NOT NULL DEFAULT 0,
+  ADD COLUMN IF NOT EXISTS skipped_count INTEGER NOT NULL DEFAULT 0;
+
+-- Add (sign 1) or remove (sign -1) the slots and checkmarks of the items
+-- matching item_filter (a condition on "items") to the runs matching
+-- run_filter (a condition on "runs").
+CREATE OR REPLACE FUNCTION add_item_progress(run_filter TEXT, item_filter TEXT, sign INTEGER)
+RETURNS void AS $$
+BEGIN
+  EXECUTE format($sql$
+    UPDATE runs SET
+      slot_count = runs.slot_count + $1 * progress.slot_count,
+      checked_count = runs.checked_count + $1 * progress.checked_count,
+      skipped_count = runs.skipped_count + $1 * progress.skipped_count
+    FROM (
+      SELECT
+        runs.id AS run_id,
+        sum(
+          CASE WHEN items.type = 'once' THEN 1
+          ELSE (SELECT count(*) FROM targets WHERE targets.run_id = runs.id)
+          END
+        ) AS slot_count,
+        sum((
+          SELECT count(*) FILTER (WHERE checkmarks.type = 'normal')
+          FROM checkmarks
+          WHERE checkmarks.run_id = runs.id
+            AND checkmarks.item_id = items.id
+            AND (checkmarks.target_id IS NULL) = coalesce(items.type = 'once', false)
+        )) AS checked_count,
+        sum((
+          SELECT count(*) FILTER (WHERE checkmarks.type = 'not applicable')
+          FROM checkmarks
+          WHERE checkmarks.run_id = runs.id
+            AND checkmarks.item_id = items.id
+            AND (checkmarks.target_id IS NULL) = coalesce(items.type = 'once', false)
+        )) AS skipped_count
+      FROM runbooks
+      JOIN runs ON runs.runbook_id = runbooks.id
+      JOIN sections ON sections.runbook_id = runbooks.id
+      JOIN items ON items.section_id = sections.id
+      WHERE (%s) AND (%s)
+      GROUP BY runs.id
+    ) AS progress
+    WHERE runs.id = progress.run_id
+  $sql$, run_filter, item_filter) USING sign;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION checkmarks_progress() RETURNS trigger AS $$
+DECLARE
+  mark checkmarks;
+  sign INTEGER;
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    mark := NEW;
+    sign := 1;
+  ELSE
+    mark := OLD;
+    sign := -1;
+  END IF;
+  UPDATE runs SET
+    checked_count = checked_count + CASE WHEN mark.type = 'normal' THEN sign ELSE 0 END,
+    skipped_count = skipped_count + CASE WHEN mark.type = 'not applicable' THEN sign ELSE 0 END
+  FROM items
+  WHERE runs.id = mark.run_id
+    AND items.id = mark.item_id
+    AND CASE WHEN items.type = 'once' THEN mark.target_id IS NULL
+        ELSE EXISTS (SELECT FROM targets WHERE targets.id = mark.target_id)
+        END;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Before a delete or a change of type/section the item still counts as it
+-- did; afterwards it counts as it does now.
+CREATE OR REPLACE FUNCTION items_progress() RETURNS trigger AS $$
+BEGIN
+  IF TG_WHEN = 'BEFORE' THEN
+    PERFORM add_item_progress('true', format('items.id = %s', OLD.id), -1);
+    IF TG_OP = 'DELETE' THEN
+      RETURN OLD;
+    END IF;
+    RETURN NEW;
+  END IF;
+  PERFORM add_item_progress('true', format('items.id = %s', NEW.id), 1);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION runs_progress() RETURNS trigger AS $$
+BEGIN
+  PERFORM add_item_progress(format('runs.id = %s', NEW.id), 'true', 1);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION sections_progress() RETURNS trigger AS $$
+BEGIN
+  PERFORM add_item_progress('true', format('sections.id = %s', OLD.id), -1);
+  RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION targets_progress() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    UPDATE runs SET slot_count = slot_count + (
+      SELECT count(*)
+      FROM sections
+      JOIN items ON items.section_id = sections.id
+      WHERE sections.runbook_id = runs.runbook_id
+        AND items.type IS DISTINCT FROM 'once'
+    )
+    WHERE id = NEW.run_id;
+    RETURN NULL;
+  END IF;
+  UPDATE runs SET
+    slot_count = runs.slot_count - progress.slot_count,
+    checked_count = runs.checked_count - progress.checked_count,
+    skipped_count = runs.skipped_count - progress.skipped_count
+  FROM (
+    SELECT
+      count(*) AS slot_count,
+      count(checkmarks.id) FILTER (WHERE checkmarks.type = 'normal') AS checked_count,
+      count(checkmarks.id) FILTER (WHERE checkmarks.type = 'not applicable') AS skipped_count
+    FROM runs
+    JOIN sections ON sections.runbook_id = runs.runbook_id
+    JOIN items ON items.section_id = sections.id
+    LEFT JOIN checkmarks ON checkmarks.item_id = items.id
+      AND checkmarks.run_id = runs.id
+      AND checkmarks.target_id = OLD.id
+    WHERE runs.id = OLD.run_id
+      AND items.type IS DISTINCT FROM 'once'
+  ) AS progress
+  WHERE runs.id = OLD.run_id;
+  RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS checkmarks_progress ON checkmarks;
+CREATE TRIGGER checkmarks_progress
+  AFTER INSERT OR DELETE ON checkmarks
+  FOR EACH ROW EXECUTE FUNCTION checkmarks_progress();
+
+DROP TRIGGER IF EXISTS items_progress_before ON items;
+CREATE TRIGGER items_progress_before
+  BEFORE DELETE OR UPDATE OF type, section_id ON items
+  FOR EACH ROW EXECUTE FUNCTION items_progress();
+
+DROP TRIGGER IF EXISTS items_progress ON items;
+CREATE TRIGGER items_progress
+  AFTER INSERT OR UPDATE OF type, section_id ON items
+  FOR EACH ROW EXECUTE FUNCTION items_progress();
+
+DROP TRIGGER IF EXISTS runs_progress ON runs;
+CREATE TRIGGER runs_progress
+  AFTER INSERT ON runs
+  FOR EACH ROW EXECUTE FUNCTION runs_progress();
+
+DROP TRIGGER IF EXISTS sections_progress ON sections;
+CREATE TRIGGER sections_progress
+  BEFORE DELETE ON sections
+  FOR EACH ROW EXECUTE FUNCTION sections_progress();
+
+DROP TRIGGER IF EXISTS targets_progress_before ON targets;
+CREATE TRIGGER targets_progress_before
+  BEFORE DELETE ON targets
+  FOR EACH ROW EXECUTE FUNCTION targets_progress();
+
+DROP TRIGGER IF EXISTS targets_progress ON targets;
+CREATE TRIGGER targets_progress
+  AFTER INSERT ON targets
+  FOR EACH ROW EXECUTE FUNCTION targets_progress();
+
+UPDATE runs SET slot_count = 0, checked_count = 0, skipped_count = 0;
+SELECT add_item_progress('true', 'true', 1);
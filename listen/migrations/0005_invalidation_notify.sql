@@ -0,0 +1,52 @@
+-- Each worker caches fragments rendered from runbooks, sections, items,
+-- runs and targets (see listen/cache.py). Changes to those rows are
+-- announced on the "invalidations" channel, whichever process makes them,
+-- as a JSON array of [table, id] tags: the row itself and the row it is
+-- displayed in (TG_ARGV: parent column and table), before and after the
+-- change. Updates of revisions and progress counters don't change what a
+-- fragment shows, so only the displayed columns are watched.
+
+CREATE OR REPLACE FUNCTION notify_invalidation() RETURNS trigger AS $$
+DECLARE
+  tags JSONB := '[]';
+  version JSONB;
+BEGIN
+  FOR version IN
+    SELECT r FROM unnest(ARRAY[to_jsonb(OLD), to_jsonb(NEW)]) AS r WHERE r IS NOT NULL
+  LOOP
+    tags := tags || jsonb_build_array(jsonb_build_array(TG_TABLE_NAME, version -> 'id'));
+    IF TG_NARGS > 0 THEN
+      tags := tags || jsonb_build_array(
+        jsonb_build_array(TG_ARGV[1], version -> TG_ARGV[0])
+      );
+    END IF;
+  END LOOP;
+  PERFORM pg_notify('invalidations', tags::text);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS runbooks_invalidation ON runbooks;
+CREATE TRIGGER runbooks_invalidation
+  AFTER INSERT OR DELETE OR UPDATE OF name ON runbooks
+  FOR EACH ROW EXECUTE FUNCTION notify_invalidation();
+
+DROP TRIGGER IF EXISTS sections_invalidation ON sections;
+CREATE TRIGGER sections_invalidation
+  AFTER INSERT OR DELETE OR UPDATE OF name, rank, runbook_id ON sections
+  FOR EACH ROW EXECUTE FUNCTION notify_invalidation('runbook_id', 'runbooks');
+
+DROP TRIGGER IF EXISTS items_invalidation ON items;
+CREATE TRIGGER items_invalidation
+  AFTER INSERT OR DELETE OR UPDATE OF name, type, rank, section_id ON items
+  FOR EACH ROW EXECUTE FUNCTION notify_invalidation('section_id', 'sections');
+
+DROP TRIGGER IF EXISTS runs_invalidation ON runs;
+CREATE TRIGGER runs_invalidation
+  AFTER INSERT OR DELETE OR UPDATE OF name, runbook_id ON runs
+  FOR EACH ROW EXECUTE FUNCTION notify_invalidation('runbook_id', 'runbooks');
+
+DROP TRIGGER IF EXISTS targets_invalidation ON targets;
+CREATE TRIGGER targets_invalidation
+  AFTER INSERT OR DELETE OR UPDATE OF name, run_id ON targets
+  FOR EACH ROW EXECUTE FUNCTION notify_invalidation('run_id', 'runs');
@@ -0,0 +1,44 @@
+-- Sections and items are ordered by (rank, id) within their parent. Ranks
+-- are spaced 1024 apart, so a row can be moved between two others by
+-- giving it the rank halfway between theirs; only when two neighbours are
+-- adjacent do their siblings have to be renumbered (see Ranked.move).
+
+UPDATE sections SET rank = ordered.position * 1024
+FROM (
+  SELECT id, row_number() OVER (PARTITION BY runbook_id ORDER BY rank, id) AS position
+  FROM sections
+) AS ordered
+WHERE sections.id = ordered.id;
+
+UPDATE items SET rank = ordered.position * 1024
+FROM (
+  SELECT id, row_number() OVER (PARTITION BY section_id ORDER BY rank, id) AS position
+  FROM items
+) AS ordered
+WHERE items.id = ordered.id;
+
+-- Rows inserted without a rank go last. TG_ARGV[0] is the parent column.
+CREATE OR REPLACE FUNCTION default_rank() RETURNS trigger AS $$
+BEGIN
+  IF NEW.rank IS NULL THEN
+    EXECUTE format(
+      'SELECT coalesce(max(rank), 0) + 1024 FROM %I WHERE %I = $1',
+      TG_TABLE_NAME,
+      TG_ARGV[0]
+    )
+    INTO NEW.rank
+    USING (to_jsonb(NEW) ->> TG_ARGV[0])::integer;
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS sections_default_rank ON sections;
+CREATE TRIGGER sections_default_rank
+  BEFORE INSERT ON sections
+  FOR EACH ROW EXECUTE FUNCTION default_rank('runbook_id');
+
+DROP TRIGGER IF EXISTS items_default_rank ON items;
+CREATE TRIGGER items_default_rank
+  BEFORE INSERT ON items
+  FOR EACH ROW EXECUTE FUNCTION default_rank('section_id');
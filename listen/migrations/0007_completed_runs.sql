@@ -0,0 +1,32 @@
+-- Completed runs are frozen: Run.complete() stores what the run looked
+-- like in run_snapshots (the runbook tree, targets and checkmarks it was
+-- rendered from, and that rendering, gzip-compressed) and deletes its
+-- checkmarks. Their progress stays as it was when they were completed,
+-- whatever later happens to the runbook.
+
+ALTER TABLE runs ADD COLUMN IF NOT EXISTS completed_at TIMESTAMPTZ;
+
+CREATE TABLE IF NOT EXISTS run_snapshots (
+  run_id INTEGER PRIMARY KEY REFERENCES runs (id) ON DELETE CASCADE,
+  tree JSONB NOT NULL,
+  html BYTEA NOT NULL
+);
+
+-- The progress triggers of 0004 still run for completed runs (deleting
+-- their checkmarks, changing their runbook); the counters just keep their
+-- values.
+CREATE OR REPLACE FUNCTION freeze_completed_progress() RETURNS trigger AS $$
+BEGIN
+  IF OLD.completed_at IS NOT NULL THEN
+    NEW.slot_count := OLD.slot_count;
+    NEW.checked_count := OLD.checked_count;
+    NEW.skipped_count := OLD.skipped_count;
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS runs_freeze_completed_progress ON runs;
+CREATE TRIGGER runs_freeze_completed_progress
+  BEFORE UPDATE OF slot_count, checked_count, skipped_count ON runs
+  FOR EACH ROW EXECUTE FUNCTION freeze_completed_progress();
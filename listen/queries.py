@@ -0,0 +1,90 @@
+import contextvars
+import logging
+
+
+logger = logging.getLogger(__name__)
+query_log = contextvars.ContextVar("query_log", default=None)
+
+
+class QueryLog:
+    """Statements run on behalf of one request.
+
+    The same statement run `repeats` times in a request is most likely
+    issued once per row of something: it is reported as an N+1 candidate.
+    """
+
+    repeats = 5
+
+    def __init__(self, route, stats=None):
+        self.route = route
+        self.stats = stats
+        self.count = 0
+        self.duration = 0.0
+        self.rows = 0
+        self.shapes = {}  # statement -> times run
+
+    def record(self, statement, duration, rows):
+        self.count += 1
+        self.duration += duration
+        self.rows += max(rows, 0)
+        n = self.shapes[statement] = self.shapes.get(statement, 0) + 1
+        if n == self.repeats:
+            logger.warning(
+                "%s ran the same statement %d times: %s",
+                self.route,
+                n,
+                shape(statement),
+            )
+        if self.stats is not None:
+            self.stats.record(self.route, statement, duration, rows, n == self.repeats)
+
+    def server_timing(self):
+        return f'db;dur={self.duration * 1000:.2f};desc="{self.count} queries"'
+
+
+class QueryStats:
+    """Totals per route and statement, since startup or the last clear()."""
+
+    def __init__(self):
+        self.enabled = False
+        self.entries = {}  # (route, statement) -> [count, seconds, rows, n+1]
+
+    def record(self, route, statement, duration, rows, repeated):
+        entry = self.entries.get((route, statement))
+        if entry is None:
+            entry = self.entries[route, statement] = [0, 0.0, 0, 0]
+        entry[0] += 1
+        entry[1] += duration
+        entry[2] += max(rows, 0)
+        entry[3] += repeated
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        # The statements that took longest overall come first.
+        report = []
+        for (route, statement), entry in self.entries.items():
+            count, seconds, rows, repeated = entry
+            report.append(
+                {
+                    "route": route,
+                    "statement": shape(statement),
+                    "count": count,
+                    "total_ms": seconds * 1000,
+                    "mean_ms": seconds * 1000 / count,
+                    "rows": rows,
+                    "n_plus_one": repeated,
+                }
+            )
+        report.sort(key=lambda entry: entry["total_ms"], reverse=True)
+        return report
+
+
+def shape(statement):
+    if not isinstance(statement, str):
+        statement = str(statement)
+    return " ".join(statement.split())
+
+
+statements = QueryStats()
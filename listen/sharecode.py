@@ -0,0 +1,127 @@
+"""Share codes: runbook dumps as pasteable text.
+
+A code is base85 of a version byte followed by the payload:
+
+- v0: gzip of the JSON dump.
+- v1: raw deflate, primed with ZDICT, of a binary dump. Strings are the
+  varint `len + 1` of their UTF-8 (0 for NULL, as names entered empty
+  are) followed by it; a runbook is its name and the varint number of
+  sections, a section its name and number of items, and an item the
+  varint `(len + 1) << 2 | ITEM_TYPES.index(type)` followed by its name.
+
+Codes are decoded long after they were made: ZDICT and ITEM_TYPES must
+never change, a new dictionary needs a new version.
+"""
+
+import base64
+import gzip
+import json
+import zlib
+
+
+ITEM_TYPES = ("once", "each", None)
+
+# Words common in runbooks. Deflate can refer back to any of them from the
+# first byte of the code; the most frequent come last, where the
+# references are shortest.
+ZDICT = " ".join(
+    [
+        "Notify Announce Schedule Document Review Approve Sign off",
+        "Download Upload Copy Move Rename Delete Remove Clean up Archive",
+        "Monitor Measure Compare Confirm Validate Ensure Make sure",
+        "firewall certificate credentials password account permissions",
+        "network DNS proxy load balancer cluster node container image",
+        "service server database backup restore snapshot migration",
+        "logs metrics alerts dashboard monitoring on-call incident ticket",
+        "version release branch build tests staging production rollback",
+        "Open Close Start Stop Restart Enable Disable Install Upgrade",
+        "Update Deploy Configure Create Prepare Run Verify Check Test",
+        "the and for with from to of on in is are all",
+    ]
+).encode("utf-8")
+
+
+def encode(dump):
+    name, sections = dump
+    out = bytearray()
+    write_string(out, name)
+    write_varint(out, len(sections))
+    for section_name, items in sections:
+        write_string(out, section_name)
+        write_varint(out, len(items))
+        for item_name, item_type in items:
+            data = b"" if item_name is None else item_name.encode("utf-8")
+            length = 0 if item_name is None else len(data) + 1
+            write_varint(out, length << 2 | ITEM_TYPES.index(item_type))
+            out += data
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=ZDICT)
+    payload = compressor.compress(out) + compressor.flush()
+    return base64.b85encode(b"\x01" + payload).decode("ascii")
+
+
+def decode(code):
+    data = base64.b85decode(code)
+    version, payload = data[0], data[1:]
+    if version == 0:
+        return json.loads(gzip.decompress(payload).decode("utf-8"))
+    if version != 1:
+        raise ValueError(f"unknown share code version {version}")
+    decompressor = zlib.decompressobj(-15, zdict=ZDICT)
+    reader = Reader(decompressor.decompress(payload) + decompressor.flush())
+    name = reader.string()
+    sections = []
+    for _ in range(reader.varint()):
+        section_name = reader.string()
+        items = []
+        for _ in range(reader.varint()):
+            header = reader.varint()
+            items.append([reader.text(header >> 2), ITEM_TYPES[header & 3]])
+        sections.append([section_name, items])
+    return [name, sections]
+
+
+def write_varint(out, n):
+    while n >= 0x80:
+        out.append(n & 0x7F | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def write_string(out, s):
+    if s is None:
+        write_varint(out, 0)
+        return
+    data = s.encode("utf-8")
+    write_varint(out, len(data) + 1)
+    out += data
+
+
+class Reader:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def varint(self):
+        n = shift = 0
+        while True:
+            byte = self.data[self.pos]
+            self.pos += 1
+            n |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return n
+            shift += 7
+
+    def text(self, length):
+        # length is the encoded one, 0 for NULL
+        if length == 0:
+            return None
+        length -= 1
+        end = self.pos + length
+        if end > len(self.data):
+            raise ValueError("truncated share code")
+        s = self.data[self.pos : end].decode("utf-8")
+        self.pos = end
+        return s
+
+    def string(self):
+        return self.text(self.varint())
@@ -0,0 +1,395 @@
+import functools
+import html
+import re
+import string
+
+
+# Names and classes come back over and over (every target of every item),
+# so their escaped forms are kept.
+escape_text = functools.lru_cache(maxsize=4096)(html.escape)
+
+
+def escape(value):
+    if type(value) is int:
+        return str(value)
+    return escape_text(value if type(value) is str else str(value))
+
+
+def collapse(source):
+    # Inside a tag every run of whitespace becomes one space (none before
+    # the closing ">"); between tags it becomes a newline if it spanned
+    # lines, a space otherwise. The rendering is the same: there is no
+    # <pre> or similar in these fragments.
+    parts = []
+    for i, part in enumerate(re.split(r"(<[^>]*>)", source.strip())):
+        if i % 2:
+            part = re.sub(r"\s+", " ", part)
+            part = re.sub(r"^< | (?=/?>$)", lambda m: m[0].strip(), part)
+        else:
+            part = re.sub(r"\s+", lambda m: "\n" if "\n" in m[0] else " ", part)
+        parts.append(part)
+    return "".join(parts)
+
+
+def template(source):
+    """Compile an HTML fragment into a function of its fields.
+
+    `{field}` is replaced by the escaped value of the keyword argument of
+    that name; fields ending in `_html` take markup and are inserted as
+    they are. Whitespace is collapsed at compile time, and the function
+    escapes each field once and joins the parts with a single f-string.
+    """
+    fields = []
+    body = []
+    for literal, field, _, _ in string.Formatter().parse(collapse(source)):
+        body.append(literal.replace("{", "{{").replace("}", "}}"))
+        if field is not None:
+            if field not in fields:
+                fields.append(field)
+            body.append(f"{{{field}}}")
+    code = [f"def render(*, {', '.join(fields)}):"] if fields else ["def render():"]
+    for field in fields:
+        if not field.endswith("_html"):
+            code.append(f"    {field} = escape({field})")
+    code.append(f"    return f{''.join(body)!r}")
+    namespace = {"escape": escape}
+    exec("\n".join(code), namespace)
+    return namespace["render"]
+
+
+RUNBOOK_LINK = template(
+    """
+    <a
+        class="label actionable"
+        hx-get="/runbooks/{id}"
+        hx-target="#container"
+        hx-push-url="/_/runbooks/{id}"
+    >
+        {name}
+    </a>
+    {runs_html}
+
+    </div>
+    """
+)
+
+RUNBOOK_RUNS = template(
+    """
+    <ul>
+        {more_runs_html}
+        {runs_html}
+        {new_run_input_html}
+    </ul>
+    """
+)
+
+RUNBOOK_RUN = template("<li>{link_html}{progress_html}</li>")
+
+MORE_RUNS = template(
+    """
+    <li>
+        <a
+            class="actionable"
+            hx-get="/runbooks/{id}"
+            hx-target="#container"
+            hx-push-url="/_/runbooks/{id}"
+        >{hidden} earlier runs…</a>
+    </li>
+    """
+)
+
+# The editable names send their text once typing has paused for 500 ms, so
+# a burst of keystrokes is one write; see the change routes in app.py.
+RUNBOOK_HEADING = template(
+    """
+    <h1
+        hx-post="/runbooks/change/{id}"
+        hx-swap="none"
+        hx-trigger="input delay:500ms"
+        hx-sync="this:queue last"
+        hx-on::config-request="event.detail.parameters.name = this.textContent"
+        class="editable"
+        contenteditable
+    >{name}</h1>
+    """
+)
+
+RUNBOOK_DETAIL = template(
+    """
+    <a class="noprint" href="/">↰ Runbooks</a><br>
+    {heading_html}
+    {dump_button_html}
+
+    {sections_html}
+
+    {new_section_input_html}
+
+    <hr>
+    {runs_html}
+    """
+)
+
+DUMP_BUTTON = template(
+    """
+    <a
+        hx-get="/runbooks/dump/{id}"
+        class="top-right large-icon actionable"
+    >📋</a>
+    """
+)
+
+NEW_SECTION_INPUT = template(
+    """
+    <input
+        type="text"
+        name="name"
+        placeholder="New section"
+        hx-swap="outerHTML"
+        hx-post="/sections/new/{id}"
+    >
+    """
+)
+
+NEW_RUN_INPUT = template(
+    """
+    <input
+        type="text"
+        name="name"
+        placeholder="New run"
+        hx-swap="outerHTML"
+        hx-post="/runs/new/{id}"
+    >
+    """
+)
+
+NEW_RUNBOOK_INPUT = template(
+    """
+    <input
+        type="text"
+        name="name"
+        placeholder="New runbook"
+        hx-swap="outerHTML"
+        hx-post="/runbooks/new"
+    >
+    """
+)
+
+LOAD_INPUT = template(
+    """
+    <input
+        hx-post="/runbooks/load"
+        hx-target="#container"
+        hx-trigger="keydown[key=='Enter']"
+        class="top-right"
+        name="code"
+        placeholder="Enter share code"
+    >
+    """
+)
+
+SECTION_HEADING = template(
+    """
+    <h2
+        hx-post="/sections/change/{id}"
+        hx-swap="none"
+        hx-trigger="input delay:500ms"
+        hx-sync="this:queue last"
+        hx-on::config-request="event.detail.parameters.name = this.textContent"
+        class="editable"
+        contenteditable
+    >{name}</h2>
+    """
+)
+
+SECTION_DETAIL = template(
+    """
+    <section data-kind="section" data-id="{id}" data-move="/sections/move/{id}">
+    <span class="handle noprint" draggable="true">⠿</span>
+    {heading_html}
+
+    <ul>
+    {items_html}
+    {new_item_input_html}
+    </ul>
+    </section>
+    """
+)
+
+NEW_ITEM_INPUT = template(
+    """
+    <input
+        type="text"
+        name="name"
+        placeholder="New item"
+        hx-swap="outerHTML"
+        hx-post="/items/new/{id}"
+        {autofocus_html}
+    >
+    """
+)
+
+ITEM_DETAIL = template(
+    """
+    <li data-kind="item" data-id="{id}" data-move="/items/move/{id}">
+        <span class="handle noprint" draggable="true">⠿</span>
+        <span
+            hx-post="/items/toggle/{id}"
+            hx-swap="outerHTML"
+            hx-target="closest li"
+            class="actionable type type-{type}"
+        >{symbol}</span>
+        <span
+            hx-post="/items/change/{id}"
+            hx-swap="none"
+            hx-trigger="input delay:500ms"
+            hx-sync="this:queue last"
+            hx-on::config-request="event.detail.parameters.name = this.textContent"
+            class="editable"
+            contenteditable
+        >{name}</span>
+    </li>
+    """
+)
+
+ONCE_CHECKBOX = template(
+    """
+    <li
+        hx-post="/checkmarks/check/{run_id}/{id}"
+        hx-swap="outerHTML"
+        hx-trigger="click[!ctrlKey]"
+        hx-sse="swap:item-{id}"
+        class="{classes}"
+    >{name}
+        <span
+            hx-post="/checkmarks/disable/{run_id}/{id}"
+            hx-swap="outerHTML"
+            hx-target="closest li"
+            hx-trigger="click[ctrlKey] from:closest li"
+        ></span>
+    </li>
+    """
+)
+
+EACH_CHECKBOX = template(
+    """
+    <li
+        class="multi{extra_class}"
+        hx-swap="outerHTML"
+        hx-sse="swap:item-{id}"
+    >{name}
+    <ul>
+    {targets_html}
+    </ul>
+    </li>
+    """
+)
+
+TARGET_CHECKBOX = template(
+    """
+    <li
+        class="{classes}"
+        hx-post="/checkmarks/check/{run_id}/{id}/{target_id}"
+        hx-swap="outerHTML"
+        hx-target="closest li.multi"
+        hx-trigger="click[!ctrlKey]"
+    >
+    <span
+        hx-post="/checkmarks/disable/{run_id}/{id}/{target_id}"
+        hx-swap="outerHTML"
+        hx-target="closest li.multi"
+        hx-trigger="click[ctrlKey] from:(closest li)"
+    ></span>
+    <div
+        class="multilabel target target-{i}"
+    >{target_name}</div></li>
+    """
+)
+
+RUN_LINK = template(
+    """
+    <a
+        class="label actionable"
+        hx-get="/runs/{id}"
+        hx-target="#container"
+        hx-push-url="/_/runs/{id}"
+    >
+        {name}
+    </a>
+    """
+)
+
+RUN_PROGRESS = template(
+    """
+    <progress
+        max="{slot_count}"
+        value="{done}"
+        title="{done}/{slot_count}"
+    ></progress>
+    """
+)
+
+RUN_HEADING = template(
+    """
+    <h1
+        hx-post="/runs/change/{id}"
+        hx-swap="none"
+        hx-trigger="input delay:500ms"
+        hx-sync="this:queue last"
+        hx-on::config-request="event.detail.parameters.name = this.textContent"
+        class="editable"
+        contenteditable
+    >{name}</h1>
+    """
+)
+
+RUN_EVENTS = template('<div hx-sse="connect:/runs/{id}/events">')
+
+COMPLETE_BUTTON = template(
+    """
+    <a
+        hx-post="/runs/complete/{id}"
+        hx-target="#container"
+        hx-sse="swap:completed"
+        hx-confirm="Complete this run? Its checkmarks can't be changed afterwards."
+        title="Complete the run"
+        class="top-right large-icon actionable noprint"
+    >🏁</a>
+    """
+)
+
+# Completed runs are stored rendered: hx-disable makes what they share with
+# live ones inert.
+RUN_SNAPSHOT = template('<div class="completed" hx-disable>')
+
+RUN_TITLE = template("<h1>{name}</h1>")
+
+BACK_LINK = template('<a class="noprint" href="/">↰ Runbooks</a><br>')
+
+# Targets added elsewhere replace the labels only, so the input keeps its
+# focus and whatever is being typed in it.
+RUN_TARGETS = template(
+    """
+    <div class="targets noprint">
+        Targets: <span hx-sse="swap:targets">{targets_html}</span>
+        {new_target_input_html}
+    </div>
+    """
+)
+
+TARGET_LABEL = template('<span class="target target-{i}">{name}</span>')
+
+NEW_TARGET_INPUT = template(
+    """
+    <input
+        type="text"
+        name="name"
+        placeholder="New target"
+        hx-swap="none"
+        hx-post="/targets/new/{id}"
+        hx-on::after-request="if (event.detail.successful) this.value = ''"
+        autofocus
+    >
+    """
+)
+
+RUN_SECTION_START = template("<section><h2>{name}</h2><ul>")
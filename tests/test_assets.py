@@ -0,0 +1,46 @@
+import gzip
+import pytest
+from listen.assets import Asset, negotiate
+
+
+AVAILABLE = ["br", "zstd", "gzip"]
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, expected",
+    [
+        ("gzip", ["gzip"]),
+        ("gzip, br", ["br", "gzip"]),
+        ("gzip;q=1.0, br;q=0.5", ["gzip", "br"]),
+        ("br;q=0.2, zstd;q=0.8, gzip;q=0.5", ["zstd", "gzip", "br"]),
+        ("GZIP, Br", ["br", "gzip"]),
+        (" gzip ; q=0.5 ,br", ["br", "gzip"]),
+        ("gzip;q=0", []),
+        ("gzip;q=x, br", ["br"]),
+        ("identity", []),
+        ("", []),
+        ("*", ["br", "zstd", "gzip"]),
+        ("*;q=0.5, gzip", ["gzip", "br", "zstd"]),
+        ("*;q=0", []),
+        ("*;q=0, gzip", ["gzip"]),
+        ("br;q=0, *", ["zstd", "gzip"]),
+    ],
+)
+def test_negotiate(accept_encoding, expected):
+    assert negotiate(accept_encoding, AVAILABLE) == expected
+
+
+def test_asset_encoded():
+    body = b"<p>" + b"listen " * 200 + b"</p>"
+    asset = Asset(body, "text/html")
+    compressed, encoding = asset.encoded("gzip")
+    assert encoding == "gzip"
+    assert gzip.decompress(compressed) == body
+    assert asset.encoded("gzip;q=0") == (body, None)
+    assert asset.encoded("") == (body, None)
+
+
+def test_asset_skips_encodings_that_grow():
+    asset = Asset(b"x", "text/plain")
+    assert asset.encodings == {}
+    assert asset.encoded("gzip, br") == (b"x", None)
@@ -0,0 +1,105 @@
+import sys
+from listen.cache import FragmentCache
+
+
+def html(n):
+    # distinct fragments of the same size
+    return f"<p>{n:04}</p>"
+
+
+SIZE = sys.getsizeof(html(0))
+
+
+def test_get_put():
+    cache = FragmentCache(max_bytes=10 * SIZE)
+    assert cache.get("a") is None
+    cache.put("a", html(1), [("items", 1)])
+    assert cache.get("a") == html(1)
+    assert cache.stats() == {
+        "entries": 1,
+        "bytes": SIZE,
+        "max_bytes": 10 * SIZE,
+        "hits": 1,
+        "misses": 1,
+    }
+
+
+def test_put_replaces():
+    cache = FragmentCache(max_bytes=10 * SIZE)
+    cache.put("a", html(1), [("items", 1)])
+    cache.put("a", html(2), [("items", 2)])
+    assert cache.get("a") == html(2)
+    assert cache.size == SIZE
+    cache.invalidate(("items", 1))
+    assert cache.get("a") == html(2)
+
+
+def test_evicts_least_recently_used():
+    cache = FragmentCache(max_bytes=2 * SIZE)
+    cache.put("a", html(1), [])
+    cache.put("b", html(2), [])
+    cache.get("a")
+    cache.put("c", html(3), [])
+    assert cache.get("b") is None
+    assert cache.get("a") == html(1)
+    assert cache.get("c") == html(3)
+    assert cache.size == 2 * SIZE
+
+
+def test_stays_under_max_bytes():
+    cache = FragmentCache(max_bytes=3 * SIZE + SIZE // 2)
+    for n in range(10):
+        cache.put(n, html(n), [("items", n)])
+        assert cache.size <= cache.max_bytes
+    assert list(cache.entries) == [7, 8, 9]
+    assert set(cache.tagged) == {("items", 7), ("items", 8), ("items", 9)}
+
+
+def test_skips_oversize():
+    cache = FragmentCache(max_bytes=2 * SIZE)
+    cache.put("a", html(1), [])
+    cache.put("big", "x" * 2 * SIZE, [("items", 1)])
+    assert cache.get("big") is None
+    assert cache.get("a") == html(1)
+    assert cache.tagged == {}
+
+
+def test_invalidate():
+    cache = FragmentCache(max_bytes=10 * SIZE)
+    cache.put("item", html(1), [("items", 1)])
+    cache.put("section", html(2), [("sections", 1), ("items", 1), ("items", 2)])
+    cache.put("other", html(3), [("items", 3)])
+    cache.invalidate(("items", 1))
+    assert cache.get("item") is None
+    assert cache.get("section") is None
+    assert cache.get("other") == html(3)
+    # the section's other tags don't keep pointing at it
+    assert set(cache.tagged) == {("items", 3)}
+    assert cache.size == SIZE
+
+
+def test_invalidate_unknown_tag():
+    cache = FragmentCache(max_bytes=10 * SIZE)
+    cache.put("a", html(1), [("items", 1)])
+    cache.invalidate(("items", 2))
+    assert cache.get("a") == html(1)
+
+
+def test_skips_renders_read_before_an_invalidation():
+    cache = FragmentCache(max_bytes=10 * SIZE)
+    generation = cache.generation
+    cache.invalidate(("items", 2))
+    cache.put("a", html(1), [("items", 1)], generation)
+    assert cache.get("a") is None
+    cache.put("a", html(1), [("items", 1)], cache.generation)
+    assert cache.get("a") == html(1)
+
+
+def test_clear():
+    cache = FragmentCache(max_bytes=10 * SIZE)
+    generation = cache.generation
+    cache.put("a", html(1), [("items", 1)])
+    cache.clear()
+    assert cache.get("a") is None
+    assert cache.size == 0 and cache.tagged == {}
+    assert cache.generation != generation
@@ -0,0 +1,114 @@
+import asyncio
+import gzip
+import zlib
+from types import SimpleNamespace
+import pytest
+from listen.encoding import Compression
+
+
+BODY = b"<li>" + b"checked " * 500 + b"</li>"
+
+
+class Response:
+    # What Compression reads and writes of Sanic's responses.
+    def __init__(self, body=b"", content_type="text/html; charset=utf-8", headers=()):
+        self.body = body
+        self.content_type = content_type
+        self.headers = dict(headers)
+        self.sent = []
+        self.ended = False
+
+    async def send(self, data):
+        self.sent.append(data)
+
+    async def eof(self):
+        self.ended = True
+
+
+def request(accept_encoding):
+    return SimpleNamespace(headers={"accept-encoding": accept_encoding})
+
+
+@pytest.fixture
+def compression():
+    # Only gzip, whichever modules are installed.
+    compression = Compression(min_size=1024)
+    compression.encodings = ["gzip"]
+    return compression
+
+
+def test_compresses(compression):
+    response = Response(BODY)
+    compression.compress(request("gzip, deflate"), response)
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert gzip.decompress(response.body) == BODY
+
+
+def test_prefers_first_of_equal_encodings():
+    compression = Compression()
+    compression.encodings = ["br", "gzip"]
+    assert compression.choose(request("gzip, br"), Response(BODY)) == "br"
+    assert compression.choose(request("gzip, br;q=0.9"), Response(BODY)) == "gzip"
+
+
+def test_size_threshold(compression):
+    small = Response(BODY[:1023])
+    compression.compress(request("gzip"), small)
+    assert small.body == BODY[:1023]
+    assert "Content-Encoding" not in small.headers
+    exact = Response(BODY[:1024])
+    compression.compress(request("gzip"), exact)
+    assert exact.headers["Content-Encoding"] == "gzip"
+
+
+def test_not_accepted(compression):
+    response = Response(BODY)
+    compression.compress(request("*;q=0"), response)
+    assert response.body == BODY
+    assert "Content-Encoding" not in response.headers
+    # the response still depends on the header
+    assert response.headers["Vary"] == "Accept-Encoding"
+
+
+def test_already_encoded(compression):
+    body = gzip.compress(BODY)
+    response = Response(body, headers={"content-encoding": "gzip"})
+    compression.compress(request("gzip"), response)
+    assert response.body == body
+    assert response.headers == {"content-encoding": "gzip"}
+
+
+def test_not_compressible(compression):
+    response = Response(BODY, content_type="image/png")
+    compression.compress(request("gzip"), response)
+    assert response.body == BODY
+    assert response.headers == {}
+
+
+def test_stream_round_trip(compression):
+    response = Response()
+    stream = compression.stream(request("gzip"), response)
+    assert response.headers["Content-Encoding"] == "gzip"
+    decompressor = zlib.decompressobj(31)
+    chunks = ["<section>", "é" * 100, b"</section>"]
+
+    async def send():
+        for chunk in chunks:
+            await stream.send(chunk)
+            # every chunk can be decoded as soon as it arrives
+            data = chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+            assert decompressor.decompress(response.sent[-1]) == data
+        await stream.eof()
+
+    asyncio.run(send())
+    assert response.ended
+    assert gzip.decompress(b"".join(response.sent)) == "".join(
+        chunk if isinstance(chunk, str) else chunk.decode("utf-8") for chunk in chunks
+    ).encode("utf-8")
+
+
+def test_stream_not_accepted(compression):
+    response = Response()
+    assert compression.stream(request("identity"), response) is response
+    assert "Content-Encoding" not in response.headers
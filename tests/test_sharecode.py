@@ -0,0 +1,35 @@
+import base64
+import gzip
+import json
+import pytest
+from listen import sharecode
+
+
+DUMPS = [
+    ["Deploy", [["Prepare", [["Check backups", "once"], ["Drain", "each"]]]]],
+    [None, [["s", [[None, "once"]]], [None, []]]],
+    ["Übergabe 🚀", [["Vorbereitung", [["Prüfen, ob alles läuft", None]]]]],
+    ["", [["", [["", "each"]]]]],
+    ["Empty", []],
+]
+
+
+def encode_v0(dump):
+    # v0 codes are no longer made, but may still be pasted.
+    payload = gzip.compress(json.dumps(dump).encode("utf-8"))
+    return base64.b85encode(b"\x00" + payload).decode("ascii")
+
+
+@pytest.mark.parametrize("dump", DUMPS)
+def test_v1_round_trip(dump):
+    assert sharecode.decode(sharecode.encode(dump)) == dump
+
+
+@pytest.mark.parametrize("dump", DUMPS)
+def test_v0_round_trip(dump):
+    assert sharecode.decode(encode_v0(dump)) == dump
+
+
+def test_unknown_version():
+    with pytest.raises(ValueError):
+        sharecode.decode(base64.b85encode(b"\x07").decode("ascii"))
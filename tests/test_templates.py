@@ -0,0 +1,94 @@
+import pytest
+from listen import templates
+from listen.templates import collapse, escape, template
+
+
+def test_escapes_fields():
+    render = template("<li title={name}>{name}</li>")
+    assert render(name="<a href=\"x\">Tom & 'Jerry'</a>") == (
+        "<li title=&lt;a href=&quot;x&quot;&gt;Tom &amp; &#x27;Jerry&#x27;&lt;/a&gt;>"
+        "&lt;a href=&quot;x&quot;&gt;Tom &amp; &#x27;Jerry&#x27;&lt;/a&gt;</li>"
+    )
+
+
+def test_html_fields_pass_through():
+    render = template("<ul>{items_html}</ul><p>{name}</p>")
+    assert render(items_html="<li>&amp;</li>", name="<li>") == (
+        "<ul><li>&amp;</li></ul><p>&lt;li&gt;</p>"
+    )
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [(3, "3"), (0, "0"), (2.5, "2.5"), ("3 < 4", "3 &lt; 4"), ("", "")],
+)
+def test_escape(value, expected):
+    assert escape(value) == expected
+
+
+def test_literal_braces():
+    render = template("<div data-vals='{{\"id\": {id}}}'>}}{{</div>")
+    assert render(id=7) == "<div data-vals='{\"id\": 7}'>}{</div>"
+
+
+def test_literal_quotes_and_backslashes():
+    source = (
+        "<input hx-trigger=\"keydown[key=='Enter']\""
+        " hx-on::after-request=\"this.value = ''\""
+        " pattern=\"\\d+\" value=\"{value}\">"
+    )
+    assert template(source)(value="x") == source.replace("{value}", "x")
+
+
+def test_without_fields():
+    assert template("<hr>")() == "<hr>"
+    with pytest.raises(TypeError):
+        template("<hr>")(name="x")
+
+
+def test_fields_are_keyword_only():
+    render = template("{a}{b_html}{a}")
+    assert render(b_html="<br>", a=1) == "1<br>1"
+    with pytest.raises(TypeError):
+        render(1, "<br>")
+    with pytest.raises(TypeError):
+        render(a=1)
+
+
+def test_collapse():
+    source = """
+        <a
+            class="label  actionable"
+            hx-get="/runs/{id}"
+        >
+            {name}   and
+            more
+        </a>  <br />
+    """
+    assert collapse(source) == (
+        '<a class="label actionable" hx-get="/runs/{id}">\n{name} and\nmore\n</a> <br/>'
+    )
+
+
+def test_collapse_inside_tags():
+    assert collapse("< span\n  class='x'\t>a  b</span >") == "<span class='x'>a b</span>"
+
+
+def test_template_collapses():
+    render = template(
+        """
+        <h1
+            class="editable"
+        >{name}</h1>
+        """
+    )
+    assert render(name="Deploy") == '<h1 class="editable">Deploy</h1>'
+
+
+def test_shipped_template():
+    assert templates.RUN_PROGRESS(slot_count=4, done=1) == (
+        '<progress max="4" value="1" title="1/4"></progress>'
+    )
+    assert templates.TARGET_LABEL(i=2, name="web<1>") == (
+        '<span class="target target-2">web&lt;1&gt;</span>'
+    )